@@ -83,6 +83,11 @@ async def lifespan_with_cache_init(app: FastAPI):
         
         # Shutdown
         logger.info("🛑 Shutting down Multi-Project API...")
+        try:
+            from projects.fundraising_tracking_app.activity_integration.activity_api import get_cache as get_activity_cache
+            get_activity_cache().stop_background_services()
+        except Exception as e:
+            logger.error(f"❌ Failed to stop activity background services: {e}")
         logger.info("✅ Multi-Project API shutdown complete!")
 
 # Create main FastAPI app with lifespan management
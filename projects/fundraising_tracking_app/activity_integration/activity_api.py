@@ -9,16 +9,18 @@ from fastapi.responses import Response, JSONResponse, HTMLResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 import os
+import re
+import asyncio
 import httpx
 import logging
 
 logger = logging.getLogger(__name__)
 from datetime import datetime
 from dotenv import load_dotenv
-from .activity_cache import ActivityCache
+from .activity_cache import ActivityCache, EMPTY_MAP, _parse_iso
 # Removed complex error handlers - using FastAPI's built-in HTTPException
 from .caching import cache_manager
-from .async_processor import async_processor
+from .async_processor import async_processor, description_hash
 from .gpx_importer import GPXImporter
 from .models import (
     ActivityFeedResponse, 
@@ -108,7 +110,7 @@ def verify_frontend_access(request: Request):
             # Check if this is a development environment (no referer/origin)
             if not referer and not origin:
                 # Allow requests without referer/origin in development
-                print(f"🔓 Allowing request without referer/origin for development. Client IP: {client_ip}")
+                logger.debug("🔓 Allowing request without referer/origin for development. Client IP: %s", client_ip)
                 return True
             
             # Enhanced error message for debugging
@@ -383,7 +385,7 @@ async def get_activity_feed_demo(request: FeedRequest = Depends()):
     verify_development_access()
     try:
         cache_instance = get_cache()
-        raw_activities = cache_instance.get_activities_smart(request.limit)
+        raw_activities = await asyncio.to_thread(cache_instance.get_activities_smart, request.limit)
         
         # Process activities in parallel for better performance
         # Note: Music detection is now done during batch processing and saved to database
@@ -400,7 +402,7 @@ async def get_activity_feed_demo(request: FeedRequest = Depends()):
             detailed_activity = activity
             
             # Optimize map data - only use polyline (not summary_polyline)
-            map_data = detailed_activity.get("map", {})
+            map_data = detailed_activity.get("map") or EMPTY_MAP
             optimized_map = {
                 "polyline": map_data.get("polyline"),
                 "bounds": map_data.get("bounds", {})
@@ -481,7 +483,7 @@ def get_map_tiles_demo(z: int = Path(..., ge=0, le=18), x: int = Path(...), y: i
 async def clean_invalid_activities(api_key: str = Depends(verify_api_key)):
     """Clean invalid/unknown activities from the cache (requires API key)"""
     try:
-        result = get_cache().clean_invalid_activities()
+        result = await asyncio.to_thread(get_cache().clean_invalid_activities)
         return {
             "success": result["success"],
             "message": result["message"],
@@ -497,33 +499,67 @@ async def clean_invalid_activities(api_key: str = Depends(verify_api_key)):
         }
 
 
+# Music lines stripped from descriptions - one alternation instead of a pass per label
+MUSIC_LINE_PATTERN = re.compile(r'(?:Russell Radio|Album|Artist|Song|Track):.*?(?=\n|$)', re.IGNORECASE | re.MULTILINE)
+BLANK_LINES_PATTERN = re.compile(r'\n\s*\n')
+
+
 def _clean_description(description: str) -> str:
     """Clean description by removing music-related text patterns"""
     if not description:
         return ""
     
-    import re
-    
-    # Remove music-related patterns
-    patterns_to_remove = [
-        r'Russell Radio:.*?(?=\n|$)',  # Remove "Russell Radio: ..." lines
-        r'Album:.*?(?=\n|$)',          # Remove "Album: ..." lines
-        r'Artist:.*?(?=\n|$)',         # Remove "Artist: ..." lines (if any)
-        r'Song:.*?(?=\n|$)',           # Remove "Song: ..." lines (if any)
-        r'Track:.*?(?=\n|$)',          # Remove "Track: ..." lines (if any)
-    ]
-    
     cleaned = description
-    for pattern in patterns_to_remove:
-        cleaned = re.sub(pattern, '', cleaned, flags=re.IGNORECASE | re.MULTILINE)
+    # Every music label ends with ':' - skip the regex entirely for plain descriptions
+    if ':' in cleaned:
+        cleaned = MUSIC_LINE_PATTERN.sub('', cleaned)
     
     # Clean up extra whitespace and newlines
-    cleaned = re.sub(r'\n\s*\n', '\n', cleaned)  # Remove multiple newlines
+    cleaned = BLANK_LINES_PATTERN.sub('\n', cleaned)  # Remove multiple newlines
     cleaned = cleaned.strip()  # Remove leading/trailing whitespace
     
     return cleaned
 
 
+# Photo sizes in order of preference - GPX photos carry a "urls" dict keyed by width
+PHOTO_URL_SIZES = ("1200", "600", "300")
+_EMPTY_URLS: Dict[str, str] = {}
+
+
+def _primary_photo_url(photos: Any) -> str:
+    """Return the first available photo URL for an activity, or an empty string"""
+    if not photos:
+        return ""
+    if isinstance(photos, dict):
+        # Legacy shape: {"primary": {"url": ...}}
+        primary = photos.get("primary")
+        return (primary.get("url") or "") if primary else ""
+    
+    urls = photos[0].get("urls") or _EMPTY_URLS
+    for size in PHOTO_URL_SIZES:
+        url = urls.get(size)
+        if url:
+            return url
+    return ""
+
+
+def _in_date_range(activity: Dict[str, Any], date_from: Optional[datetime], date_to: Optional[datetime]) -> bool:
+    """Check whether an activity's local start date falls inside the requested range"""
+    try:
+        # Memoized parse - the same start dates are filtered on every feed request
+        activity_date = _parse_iso(activity["start_date_local"])
+    except (ValueError, KeyError):
+        # If date parsing fails, keep the activity
+        return True
+    
+    activity_date_naive = activity_date.replace(tzinfo=None)
+    if date_from and activity_date_naive < date_from:
+        return False
+    if date_to and activity_date_naive > date_to:
+        return False
+    return True
+
+
 def _apply_feed_filters(activities: List[Dict[str, Any]], request: FeedRequest) -> List[Dict[str, Any]]:
     """Apply additional filtering to activities based on request parameters"""
     filtered = activities.copy()
@@ -534,24 +570,11 @@ def _apply_feed_filters(activities: List[Dict[str, Any]], request: FeedRequest)
     
     # Filter by date range
     if request.date_from or request.date_to:
-        for activity in filtered[:]:  # Use slice copy to avoid modification during iteration
-            try:
-                activity_date = datetime.fromisoformat(activity["start_date_local"].replace('Z', '+00:00'))
-                activity_date_naive = activity_date.replace(tzinfo=None)
-                
-                if request.date_from and activity_date_naive < request.date_from:
-                    filtered.remove(activity)
-                    continue
-                if request.date_to and activity_date_naive > request.date_to:
-                    filtered.remove(activity)
-                    continue
-            except (ValueError, KeyError):
-                # If date parsing fails, keep the activity
-                continue
+        filtered = [a for a in filtered if _in_date_range(a, request.date_from, request.date_to)]
     
     # Filter by photo presence
     if request.has_photos is not None:
-        filtered = [a for a in filtered if bool(a.get("photos", {}).get("primary", {}).get("url")) == request.has_photos]
+        filtered = [a for a in filtered if bool(_primary_photo_url(a.get("photos"))) == request.has_photos]
     
     # Filter by description presence
     if request.has_description is not None:
@@ -643,7 +666,8 @@ async def get_activity_feed(request: FeedRequest = Depends(), api_key: str = Dep
     """
     try:
         # Get activities from cache (backend already filters by Run/Ride and date)
-        raw_activities = get_cache().get_activities_smart(request.limit)
+        # Off the event loop - a cold cache blocks on the Supabase read
+        raw_activities = await asyncio.to_thread(get_cache().get_activities_smart, request.limit)
         
         # Apply additional filtering based on request parameters
         filtered_activities = _apply_feed_filters(raw_activities, request)
@@ -678,7 +702,7 @@ async def get_activity_feed(request: FeedRequest = Depends(), api_key: str = Dep
             detailed_activity = activity
             
             # Optimize map data - only use polyline (not summary_polyline)
-            map_data = detailed_activity.get("map", {})
+            map_data = detailed_activity.get("map") or EMPTY_MAP
             optimized_map = {
                 "polyline": map_data.get("polyline"),
                 "bounds": map_data.get("bounds", {})
@@ -787,18 +811,30 @@ async def import_gpx_from_sheets(
             request.range
         )
         
+        # Music detected on earlier imports - unchanged descriptions reuse it instead of hitting Deezer
+        existing_music = await asyncio.to_thread(get_cache().get_music_by_activity_id)
+        
         processed_activities = []
         for sheet_activity in sheet_activities:
             activity = importer.process_gpx_activity(sheet_activity)
             if activity:
-                # Add to cache
-                cache = get_cache()
                 # Generate ID if not provided
                 if not activity.get('id'):
                     activity['id'] = hash(f"{activity.get('name')}{activity.get('start_date')}")
                 
+                # Only seed music generated from this exact description - a cleared or edited
+                # description must not carry the old widget through processing
+                previous_music = existing_music.get(str(activity['id']))
+                description = activity.get('description')
+                if (previous_music and description and not activity.get('music') and
+                        previous_music.get('description_hash') == description_hash(description)):
+                    activity['music'] = previous_music
+                
                 processed_activities.append(activity)
         
+        # One summary line instead of a log record per processed row
+        logger.info("📊 Processed %d/%d sheet activities with GPX data", len(processed_activities), len(sheet_activities))
+        
         # Save to cache
         if processed_activities:
             # Process through async processor for formatting and music detection
@@ -809,7 +845,7 @@ async def import_gpx_from_sheets(
             
             # Save to cache (this will merge with existing activities)
             cache = get_cache()
-            new_count = cache.add_gpx_activities(formatted_activities)
+            new_count = await asyncio.to_thread(cache.add_gpx_activities, formatted_activities)
             
             logger.info(f"✅ Imported {len(formatted_activities)} GPX activities ({new_count} new, {len(formatted_activities) - new_count} updated)")
             
@@ -5,34 +5,143 @@ Manages activity data from GPX imports with music detection and rich data suppor
 """
 
 import os
-import json
-import httpx
 import time
 import logging
-import shutil
+import queue
+import atexit
 import threading
+import traceback
+import hashlib
 import re
+import polyline
 import requests
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+from urllib.parse import quote_plus
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Any, Optional, Tuple
+from typing import Callable, List, Dict, Any, Optional, Tuple, FrozenSet
 from dotenv import load_dotenv
-from .http_clients import get_http_client
 from .supabase_cache_manager import SecureSupabaseCacheManager
-import os
+from .async_processor import find_music_matches
+from .json_utils import json_dumps_bytes, json_loads
 
-# Configure enhanced logging
+# Configure enhanced logging - records are formatted by the caller and written by one listener
+# thread, so request handlers never block on the (synchronously flushed) log file
+_log_queue = queue.SimpleQueue()
+_log_listener = QueueListener(
+    _log_queue,
+    logging.StreamHandler(),
+    logging.FileHandler('activity_integration.log')
+)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('activity_integration.log')
-    ]
+    handlers=[QueueHandler(_log_queue)]
 )
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # Performance logging is handled by the main logger
 
+# Encoded polylines only use ASCII 63 ('?') to 126 ('~') - one C-level scan rejects anything else
+POLYLINE_CHARS_PATTERN = re.compile(r"[?-~]+")
+
+# Shared read-only stand-in for activities without map data (avoids a new {} per lookup)
+EMPTY_MAP: Dict[str, Any] = {}
+
+# Caches younger than this are treated as mid-batch by the integrity checks
+FRESH_CACHE_SECONDS = 3600
+
+
+@lru_cache(maxsize=4096)
+def _parse_iso(timestamp: str) -> datetime:
+    """Parse an ISO-8601 timestamp ('Z' suffix accepted) - repeated strings reuse the parsed value"""
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+
+
+@lru_cache(maxsize=256)
+def _iso_epoch(timestamp: str) -> float:
+    """Epoch seconds for an ISO-8601 timestamp - lets freshness checks compare floats against time.time()"""
+    return _parse_iso(timestamp).timestamp()
+
+
+@lru_cache(maxsize=512)
+def _polyline_bounds_cached(polyline_string: str) -> Optional[Tuple[float, float, float, float]]:
+    """(south, north, west, east) of a polyline - only the four floats are memoized, never the decoded route"""
+    coordinates = polyline.decode(polyline_string)
+    if not coordinates:
+        return None
+    
+    # Transpose once so min/max run over flat tuples in C
+    lats, lngs = zip(*coordinates)
+    return min(lats), max(lats), min(lngs), max(lngs)
+
+
+def _log_integrity_summary(basic_data_count: int, polyline_count: int, bounds_count: int, total_activities: int,
+                           batching_flags: Optional[Tuple[bool, bool, bool]] = None) -> None:
+    """Log the passing integrity-check counts as one record (formatted lazily - skipped entirely when INFO is off)"""
+    counts = (basic_data_count, total_activities, polyline_count, total_activities, bounds_count, total_activities)
+    if batching_flags is None:
+        logger.info(
+            "Cache integrity check passed: %d/%d activities have basic data, %d/%d have polyline data, %d/%d have bounds data",
+            *counts
+        )
+    else:
+        logger.info(
+            "Cache integrity check passed (allowing batching to complete - emergency: %s, fresh: %s, batching: %s): "
+            "%d/%d activities have basic data, %d/%d have polyline data, %d/%d have bounds data",
+            *batching_flags, *counts
+        )
+
+
+def _count_integrity_coverage(activities: List[Dict[str, Any]], recent_month: str,
+                              max_missing_basic: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Count basic-data, polyline, bounds and recent-month GPS coverage in a single pass
+    Stops early (with partial counts) once more than max_missing_basic activities lack basic data
+    """
+    missing_basic_count = 0
+    polyline_count = 0
+    bounds_count = 0
+    recent_count = 0
+    recent_polyline_count = 0
+    recent_bounds_count = 0
+    for activity in activities:
+        get = activity.get  # Bind once - each activity is probed for up to six fields
+        start_date_local = get("start_date_local")
+        if not (get("id") and get("name") and get("type") and start_date_local):
+            missing_basic_count += 1
+            if max_missing_basic is not None and missing_basic_count > max_missing_basic:
+                break
+        
+        map_data = get("map") or EMPTY_MAP
+        has_polyline = bool(map_data.get("polyline"))
+        has_bounds = bool(map_data.get("bounds"))
+        polyline_count += has_polyline
+        bounds_count += has_bounds
+        
+        if start_date_local and start_date_local.startswith(recent_month):
+            recent_count += 1
+            recent_polyline_count += has_polyline
+            recent_bounds_count += has_bounds
+    
+    return {
+        "month": recent_month,
+        "total": len(activities),
+        "missing_basic": missing_basic_count,
+        "polyline": polyline_count,
+        "bounds": bounds_count,
+        "recent": recent_count,
+        "recent_polyline": recent_polyline_count,
+        "recent_bounds": recent_bounds_count
+    }
+
+
+def _is_invalid_activity(activity: Dict[str, Any], allowed_types: FrozenSet[str]) -> bool:
+    """An activity is invalid if it has no ID or is not an allowed type"""
+    return not activity.get("id") or activity.get("type") not in allowed_types
+
 load_dotenv()
 
 class ActivityCache:
@@ -45,17 +154,31 @@ class ActivityCache:
         
         # Allow custom cache duration, default to 8 hours
         self.cache_duration_hours = cache_duration_hours or int(os.getenv("ACTIVITY_CACHE_HOURS", "8"))
+        self._cache_duration_td = timedelta(hours=self.cache_duration_hours)
         
         # Filtering criteria
-        self.allowed_activity_types = ["Run", "Ride"]  # Only runs and bike rides
+        self.allowed_activity_types = frozenset(("Run", "Ride"))  # Only runs and bike rides (O(1) membership)
+        self.start_date = datetime(2025, 5, 22, tzinfo=timezone.utc)  # Activities before this date are ignored
         
         # Performance optimizations
         self._cache_data = None  # In-memory cache
         self._cache_loaded_at = None
         self._cache_ttl = 300  # 5 minutes in-memory cache TTL
+        self._status_snapshot_seconds = 30  # get_cache_status serves the in-memory copy while it is this fresh
+        self._cache_miss_at = None  # When Supabase last had no activities cache (skips re-querying within the TTL)
+        self._cache_updated_at = None  # Supabase updated_at of the in-memory copy (lets an expired TTL revalidate cheaply)
+        self._integrity_cache_key = None  # Key of the last cache data that fully passed the integrity check
+        self._integrity_failed_key = None  # Key of the last cache data that failed it
+        self._activities_index: Optional[Dict[str, Dict[str, Any]]] = None  # str(id) -> activity for the cached list
+        self._activities_index_source: Optional[List[Dict[str, Any]]] = None  # List the index was built from
+        self._last_saved_payload_hash: Optional[str] = None  # Payload last confirmed written to Supabase
+        self._latest_payload_hash: Optional[str] = None  # Payload most recently written or queued for Supabase
+        self._cache_valid_memo: Optional[Tuple[Tuple[Any, ...], datetime]] = None  # (snapshot key, valid until)
+        self._cache_lock = threading.RLock()  # Guards _cache_data/_cache_loaded_at between loaders and savers
         
         # Background services tracking
         self._background_services_started = False
+        self._shutdown_event = threading.Event()  # Set on shutdown so background loops exit promptly
         
         # Initialize cache system on startup (synchronous - no background operations)
         self.initialize_cache_system_sync()
@@ -82,6 +205,17 @@ class ActivityCache:
             logger.error(f"❌ Failed to start background services: {e}")
             self._startup_phase = "background_services_failed"
     
+    def stop_background_services(self):
+        """Stop background services on application shutdown and flush pending Supabase saves"""
+        if not self._background_services_started:
+            return
+        
+        logger.info("🛑 Stopping background services...")
+        self._shutdown_event.set()
+        self.supabase_cache.graceful_shutdown()
+        self._background_services_started = False
+        logger.info("✅ Background services stopped")
+    
     def initialize_cache_system_sync(self):
         """Initialize cache system synchronously (Phase 2) - no background operations"""
         logger.info("🔄 Initializing cache system synchronously...")
@@ -99,30 +233,32 @@ class ActivityCache:
     
     def _load_cache_sync(self) -> Optional[Dict[str, Any]]:
         """Load cache data synchronously without triggering background operations"""
-        now = datetime.now()
-        
-        # 1. Check in-memory cache first
-        if self._cache_data and self._cache_loaded_at:
-            cache_age = (now - self._cache_loaded_at).total_seconds()
-            if cache_age < self._cache_ttl:
-                return self._cache_data
-        
-        # 2. Try to load from Supabase (synchronous only)
-        if self.supabase_cache.enabled:
-            try:
-                supabase_result = self.supabase_cache.get_cache('activities', 'fundraising-app')
-                if supabase_result and supabase_result.get('data'):
-                    cache_data = supabase_result['data']
-                    
-                    # Validate data integrity
-                    if self._validate_cache_integrity(cache_data):
-                        self._cache_data = cache_data
-                        self._cache_loaded_at = now
-                        return cache_data
-            except Exception as e:
-                logger.error(f"❌ Failed to load from Supabase: {e}")
-        
-        return None
+        with self._cache_lock:
+            now = datetime.now()
+            
+            # 1. Check in-memory cache first
+            if self._cache_data and self._cache_loaded_at:
+                cache_age = (now - self._cache_loaded_at).total_seconds()
+                if cache_age < self._cache_ttl:
+                    return self._cache_data
+            
+            # 2. Try to load from Supabase (synchronous only)
+            if self.supabase_cache.enabled:
+                try:
+                    supabase_result = self.supabase_cache.get_cache('activities', 'fundraising-app')
+                    if supabase_result and supabase_result.get('data'):
+                        cache_data = supabase_result['data']
+                        
+                        # Validate data integrity
+                        if self._validate_cache_integrity(cache_data):
+                            self._cache_data = cache_data
+                            self._cache_loaded_at = now
+                            self._cache_updated_at = supabase_result.get('updated_at')
+                            return cache_data
+                except Exception as e:
+                    logger.error(f"❌ Failed to load from Supabase: {e}")
+            
+            return None
     
     def initialize_cache_system(self):
         """Initialize cache system on server startup (legacy method for background operations)"""
@@ -155,110 +291,201 @@ class ActivityCache:
         
     def _load_cache(self, trigger_emergency_refresh: bool = True) -> Dict[str, Any]:
         """Load cache: In-Memory → Supabase → Emergency Refresh (if requested)"""
-        now = datetime.now()
-        
-        # 1. Check in-memory cache first (fastest)
-        if (self._cache_data is not None and 
-            self._cache_loaded_at is not None and 
-            (now - self._cache_loaded_at).total_seconds() < self._cache_ttl):
-            logger.debug("✅ Using in-memory cache")
-            return self._cache_data
-        
-        # 2. JSON file operations removed - using Supabase-only storage
-        
-        # 3. Fallback to Supabase (source of truth)
-        if self.supabase_cache.enabled:
-            try:
-                logger.info("🔄 _load_cache: Attempting to load from Supabase...")
-                supabase_result = self.supabase_cache.get_cache('activities', 'fundraising-app')
-                logger.info("🔄 _load_cache: Supabase get_cache completed")
-                if supabase_result and supabase_result.get('data'):
-                    self._cache_data = supabase_result['data']
+        # Serialised so concurrent misses share one Supabase fetch and never see a half-swapped cache
+        with self._cache_lock:
+            now = datetime.now()
+            
+            # 1. Check in-memory cache first (fastest)
+            if (self._cache_data is not None and 
+                self._cache_loaded_at is not None and 
+                (now - self._cache_loaded_at).total_seconds() < self._cache_ttl):
+                logger.debug("✅ Using in-memory cache")
+                return self._cache_data
+            
+            # TTL lapsed - if Supabase's row is unchanged since we loaded it, keep our copy and skip the payload download
+            if (self._cache_data is not None and self._cache_updated_at is not None and
+                    self.supabase_cache.enabled):
+                metadata = self.supabase_cache.get_cache_metadata('activities', 'fundraising-app')
+                if metadata and metadata.get('updated_at') == self._cache_updated_at:
+                    logger.debug("✅ Supabase cache unchanged - revalidated in-memory cache")
                     self._cache_loaded_at = now
-                    
-                    # Validate Supabase data integrity
-                    if self._validate_cache_integrity(self._cache_data):
-                        logger.info("✅ Loaded cache from Supabase database")
-                        # JSON file operations removed
-                        return self._cache_data
+                    return self._cache_data
+            
+            # 2. JSON file operations removed - using Supabase-only storage
+            
+            # Supabase had no cache moments ago - don't pay another round trip until the TTL passes
+            recent_miss = (self._cache_miss_at is not None and
+                           (now - self._cache_miss_at).total_seconds() < self._cache_ttl)
+            
+            # 3. Fallback to Supabase (source of truth)
+            if self.supabase_cache.enabled and not recent_miss:
+                try:
+                    logger.debug("🔄 _load_cache: Attempting to load from Supabase...")
+                    supabase_result = self.supabase_cache.get_cache('activities', 'fundraising-app')
+                    logger.debug("🔄 _load_cache: Supabase get_cache completed")
+                    if supabase_result and supabase_result.get('data'):
+                        self._cache_data = supabase_result['data']
+                        self._cache_loaded_at = now
+                        self._cache_updated_at = supabase_result.get('updated_at')
+                        
+                        # Validate Supabase data integrity
+                        if self._validate_cache_integrity(self._cache_data):
+                            logger.info("✅ Loaded cache from Supabase database")
+                            # JSON file operations removed
+                            return self._cache_data
+                        else:
+                            logger.warning("❌ Supabase cache integrity check failed")
                     else:
-                        logger.warning("❌ Supabase cache integrity check failed")
-                else:
-                    logger.info("📭 No cache data found in Supabase")
-            except Exception as e:
-                logger.error(f"❌ Supabase read failed: {e}")
-        
-        # 4. Emergency refresh disabled - activities are imported manually via GPX
-        if trigger_emergency_refresh:
-            logger.info("📥 Emergency refresh disabled - import activities via GPX: POST /api/activity-integration/gpx/import-from-sheets")
-        else:
-            # No cache data found - return empty cache
-            logger.info("📥 No cache data found. Import activities via GPX: POST /api/activity-integration/gpx/import-from-sheets")
-            self._cache_data = {"timestamp": None, "activities": []}
-            return self._cache_data
+                        logger.info("📭 No cache data found in Supabase")
+                        self._cache_miss_at = now
+                except Exception as e:
+                    logger.error(f"❌ Supabase read failed: {e}")
+            
+            # 4. Emergency refresh disabled - activities are imported manually via GPX
+            if trigger_emergency_refresh:
+                logger.info("📥 Emergency refresh disabled - import activities via GPX: POST /api/activity-integration/gpx/import-from-sheets")
+            else:
+                # No cache data found - return empty cache
+                logger.info("📥 No cache data found. Import activities via GPX: POST /api/activity-integration/gpx/import-from-sheets")
+                self._cache_data = {"timestamp": None, "activities": []}
+                return self._cache_data
     
     # JSON file operations removed - using Supabase-only storage
     
     def _save_cache(self, data: Dict[str, Any]):
         """Save cache: Validate → Memory → Supabase (with retry)"""
-        # 1. Validate data first
+        # 1. Count coverage once on write so later integrity checks only compare thresholds
+        # Annotated on a new top-level dict - the caller's dict may be the one a pending background save holds
+        now = datetime.now()
+        data = {**data, '_counts': _count_integrity_coverage(data.get("activities") or [], now.strftime("%Y-%m"))}
+        
+        # 2. Validate data (fresh data - never trust a previous integrity result or index)
+        self._integrity_cache_key = None
+        self._integrity_failed_key = None
+        self._activities_index = None
+        self._activities_index_source = None
         if not self._validate_cache_integrity(data):
             logger.error("❌ Cache data validation failed, not saving")
             return
         
-        # 2. Add timestamps to data
-        data_with_timestamps = data.copy()
-        data_with_timestamps['last_saved'] = datetime.now().isoformat()
+        # Add timestamps to data (one clock read shared by the save and the memory stamp)
+        data['last_saved'] = now.isoformat()
         
         # 3. JSON file operations removed - using Supabase-only storage
         
-        # 4. Update in-memory cache
-        self._cache_data = data_with_timestamps
-        self._cache_loaded_at = datetime.now()
+        # 4. Update in-memory cache (swapped together so loaders never see a half-updated pair)
+        with self._cache_lock:
+            self._cache_data = data
+            self._cache_loaded_at = now
+            self._cache_miss_at = None
+            self._cache_updated_at = None  # Our write stamps a new updated_at - next expiry reloads once
+            self._cache_valid_memo = None
         
-        # 5. Save to Supabase (with retry logic)
-        if self.supabase_cache.enabled:
-            try:
-                # Extract timestamps for Supabase
-                last_fetch = None
-                last_rich_fetch = None
-                
-                if data_with_timestamps.get('timestamp'):
-                    last_fetch = datetime.fromisoformat(data_with_timestamps['timestamp'])
-                
-                if data_with_timestamps.get('last_rich_fetch'):
-                    last_rich_fetch = datetime.fromisoformat(data_with_timestamps['last_rich_fetch'])
-                
+        if not self.supabase_cache.enabled:
+            return
+        
+        # 5. Save to Supabase (with retry logic) - skipped when the payload is byte-identical to the last confirmed write
+        try:
+            # One encode serves the skip hash and the upload's size check
+            # last_saved is stamped on every call, so it is left out
+            payload_bytes = json_dumps_bytes({key: value for key, value in data.items() if key != 'last_saved'})
+        except Exception as e:
+            # Retrying can't fix unserializable data - keep the in-memory copy and report it
+            logger.error("❌ Cache data could not be serialized for Supabase, not saving: %s", e)
+            return
+        payload_hash = hashlib.blake2b(payload_bytes, digest_size=16).hexdigest()
+        
+        # A pending save may hold different data, so only skip when nothing is queued
+        if (payload_hash == self._last_saved_payload_hash and
+                not self.supabase_cache.has_pending_save('activities', 'fundraising-app')):
+            logger.info("⏭️ Cache unchanged since last Supabase save - skipping write")
+            return
+        
+        # The row is about to hold this payload - until it is confirmed nothing may be skipped
+        if payload_hash != self._last_saved_payload_hash:
+            self._last_saved_payload_hash = None
+        self._latest_payload_hash = payload_hash
+        
+        def mark_saved():
+            # Only a confirmed write may skip later identical saves - a dropped retry must not,
+            # and neither may an upload that a newer save has already superseded
+            if self._latest_payload_hash == payload_hash:
+                self._last_saved_payload_hash = payload_hash
+        
+        # Extract timestamps for Supabase
+        last_fetch = None
+        last_rich_fetch = None
+        encoded_size = len(payload_bytes)
+        try:
+            if data.get('timestamp'):
+                last_fetch = _parse_iso(data['timestamp'])
+            
+            if data.get('last_rich_fetch'):
+                last_rich_fetch = _parse_iso(data['last_rich_fetch'])
+            
+            if self.supabase_cache.background_saves_running():
+                # Write-behind - the retry thread uploads (coalescing bursts) so callers never wait on Supabase
+                self._queue_supabase_save(data, last_fetch, last_rich_fetch, on_saved=mark_saved,
+                                          encoded_size=encoded_size)
+                logger.info("📤 Cache queued for background Supabase save")
+            else:
                 # Save to Supabase
                 success = self.supabase_cache.save_cache(
                     'activities',
-                    data_with_timestamps,
+                    data,
                     last_fetch=last_fetch,
                     last_rich_fetch=last_rich_fetch,
-                    project_id='fundraising-app'
+                    project_id='fundraising-app',
+                    encoded_size=encoded_size
                 )
                 
                 if success:
+                    mark_saved()
                     logger.info("✅ Cache saved to Supabase successfully")
                 else:
                     logger.warning("⚠️ Failed to save to Supabase, will retry in background")
-                    
-            except Exception as e:
-                logger.error(f"❌ Supabase save error: {e}")
-                # Queue for background retry
-                self._queue_supabase_save(data_with_timestamps, last_fetch, last_rich_fetch)
+                    self._queue_supabase_save(data, last_fetch, last_rich_fetch, on_saved=mark_saved,
+                                              encoded_size=encoded_size)
+                
+        except Exception as e:
+            logger.error(f"❌ Supabase save error: {e}")
+            # Queue for background retry
+            self._queue_supabase_save(data, last_fetch, last_rich_fetch, on_saved=mark_saved,
+                                      encoded_size=encoded_size)
     
-    def _queue_supabase_save(self, data: Dict[str, Any], last_fetch: Optional[datetime] = None, last_rich_fetch: Optional[datetime] = None):
+    def _queue_supabase_save(self, data: Dict[str, Any], last_fetch: Optional[datetime] = None, last_rich_fetch: Optional[datetime] = None,
+                             on_saved: Optional[Callable[[], None]] = None, encoded_size: Optional[int] = None):
         """Queue data for background Supabase save"""
         if self.supabase_cache.enabled:
+            # Queued as is - _save_cache never annotates a dict in place once it has been handed over
             self.supabase_cache._queue_supabase_save(
                 'activities',
                 data,
                 last_fetch=last_fetch,
                 last_rich_fetch=last_rich_fetch,
-                project_id='fundraising-app'
+                project_id='fundraising-app',
+                on_saved=on_saved,
+                encoded_size=encoded_size
             )
     
+    def _get_activities_index(self, activities: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Return activities keyed by str(id), rebuilt only when the cached activity list changes"""
+        if self._activities_index is None or self._activities_index_source is not activities:
+            # Activities without an ID are invalid - never index them under a "None" key
+            self._activities_index = {str(act["id"]): act for act in activities if act.get("id")}
+            self._activities_index_source = activities
+        return self._activities_index
+    
+    def get_music_by_activity_id(self) -> Dict[str, Dict[str, Any]]:
+        """Return previously detected music keyed by activity ID, so re-imports can skip Deezer lookups"""
+        cache_data = self._load_cache(trigger_emergency_refresh=False)
+        activities = cache_data.get("activities", []) if cache_data else []
+        return {
+            activity_id: act["music"]
+            for activity_id, act in self._get_activities_index(activities).items()
+            if act.get("music")
+        }
+    
     def add_gpx_activities(self, gpx_activities: List[Dict[str, Any]]) -> int:
         """Add GPX-imported activities to the cache, merging with existing activities"""
         try:
@@ -268,41 +495,41 @@ class ActivityCache:
             cache_data = self._load_cache()
             existing_activities = cache_data.get("activities", []) if cache_data else []
             
-            # Create lookup by ID
-            existing_by_id = {str(act.get("id")): act for act in existing_activities}
+            # Lookup by ID - copied from the shared index because new activities are merged into it
+            existing_by_id = dict(self._get_activities_index(existing_activities))
             
             # Merge GPX activities with existing
             new_count = 0
             updated_count = 0
             
             for gpx_activity in gpx_activities:
-                activity_id = str(gpx_activity.get("id"))
+                raw_id = gpx_activity.get("id")
+                activity_id = str(raw_id)
+                start_date = gpx_activity.get("start_date")
+                existing = existing_by_id.get(activity_id)
                 
                 # Format activity to match expected structure (activity format)
                 formatted_activity = {
-                    "id": gpx_activity.get("id"),
+                    "id": raw_id,
                     "name": gpx_activity.get("name", "").replace('_', ' '),
                     "type": gpx_activity.get("type"),
                     "distance": gpx_activity.get("distance", 0),
                     "moving_time": gpx_activity.get("moving_time", 0),
                     "elapsed_time": gpx_activity.get("elapsed_time", 0),
                     "total_elevation_gain": gpx_activity.get("total_elevation_gain", 0),
-                    "start_date": gpx_activity.get("start_date"),
-                    "start_date_local": gpx_activity.get("start_date_local") or gpx_activity.get("start_date"),
+                    "start_date": start_date,
+                    "start_date_local": gpx_activity.get("start_date_local") or start_date,
                     "description": gpx_activity.get("description", ""),
-                    "map": {
-                        "polyline": gpx_activity.get("polyline"),
-                        "bounds": gpx_activity.get("bounds")
-                    },
-                    "photos": gpx_activity.get("photos", []),
-                    "comments": gpx_activity.get("comments", []),
-                    "music": gpx_activity.get("music", {}),  # Preserve music data (added during processing)
+                    "map": self._process_map_data(gpx_activity, existing.get("map") if existing else None),
+                    # 'or' only builds an empty container when the field is missing
+                    "photos": gpx_activity.get("photos") or [],
+                    "comments": gpx_activity.get("comments") or [],
+                    "music": gpx_activity.get("music") or {},  # Preserve music data (added during processing)
                     "source": "gpx_import"
                 }
                 
-                if activity_id in existing_by_id:
+                if existing:
                     # Merge with existing - preserve existing rich data
-                    existing = existing_by_id[activity_id]
                     # Keep existing rich data
                     if existing.get("photos"):
                         formatted_activity["photos"] = existing.get("photos")
@@ -324,11 +551,12 @@ class ActivityCache:
             # Convert back to list
             merged_activities = list(existing_by_id.values())
             
-            # Create updated cache data
+            # Create updated cache data (one clock read for both stamps)
+            now_iso = datetime.now().isoformat()
             updated_cache = {
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": now_iso,
                 "activities": merged_activities,
-                "last_gpx_import": datetime.now().isoformat()
+                "last_gpx_import": now_iso
             }
             
             # Save to cache
@@ -341,47 +569,61 @@ class ActivityCache:
             logger.error(f"❌ Failed to add GPX activities: {e}")
             return 0
     
+    def _process_map_data(self, gpx_activity: Dict[str, Any], existing_map: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Build map data, reusing the cached map when the polyline is unchanged"""
+        polyline_string = gpx_activity.get("polyline")
+        
+        # Same route as last import - keep the bounds we already have
+        if existing_map and existing_map.get("polyline") == polyline_string and existing_map.get("bounds"):
+            return existing_map
+        
+        bounds = gpx_activity.get("bounds")
+        if not bounds and polyline_string:
+            bounds = self._calculate_bounds_from_polyline(polyline_string) or None
+        
+        return {
+            "polyline": polyline_string,
+            "bounds": bounds
+        }
+    
     def _is_cache_valid(self, cache_data: Dict[str, Any]) -> bool:
-        """Smart cache validation with multiple criteria"""
+        """Smart cache validation with multiple criteria (a positive answer is memoized until it can change)"""
         if not cache_data.get("timestamp"):
             return False
         
-        # Check data integrity first - if data is complete, cache is valid regardless of age
-        if self._validate_cache_integrity(cache_data):
-            activities = cache_data.get("activities", [])
-            if len(activities) >= 10:  # Reasonable threshold
-                logger.info(f"Cache has complete data ({len(activities)} activities), considering valid despite age")
-                return True
-        
-        # If data is incomplete, check time-based validation
-        cache_time = datetime.fromisoformat(cache_data["timestamp"])
-        expiry_time = cache_time + timedelta(hours=self.cache_duration_hours)
+        activities = cache_data.get("activities", [])
         now = datetime.now()
         
-        # Basic time-based validation
-        if now >= expiry_time:
-            return False
+        # Same snapshot as last time and its answer hasn't expired yet - skip the checks (and their logging)
+        memo_key = (id(cache_data), cache_data["timestamp"], cache_data.get("last_rich_fetch"), len(activities))
+        memo = self._cache_valid_memo
+        if memo is not None and memo[0] == memo_key and now < memo[1]:
+            return True
+        
+        # Cheap time-based validation first - a fresh cache never needs the integrity scan
+        cache_duration = self._cache_duration_td
+        valid_until = _parse_iso(cache_data["timestamp"]) + cache_duration
         
         # Smart validation: Check if we have recent rich data
         last_rich_fetch = cache_data.get("last_rich_fetch")
         if last_rich_fetch:
-            rich_fetch_time = datetime.fromisoformat(last_rich_fetch)
-            rich_expiry_time = rich_fetch_time + timedelta(hours=self.cache_duration_hours)
-            
-            # If rich data is also expired, definitely need refresh
-            if now >= rich_expiry_time:
-                return False
+            valid_until = min(valid_until, _parse_iso(last_rich_fetch) + cache_duration)
         
-        # Additional smart checks
-        activities = cache_data.get("activities", [])
-        if not activities:
-            return False
+        if now < valid_until and activities:
+            # Check if we have a reasonable number of activities
+            if len(activities) < 10:  # Arbitrary threshold
+                logger.warning(f"Cache has only {len(activities)} activities, may need refresh")
+            self._cache_valid_memo = (memo_key, valid_until)
+            return True
         
-        # Check if we have a reasonable number of activities
-        if len(activities) < 10:  # Arbitrary threshold
-            logger.warning(f"Cache has only {len(activities)} activities, may need refresh")
+        # Expired - if data is complete, cache is valid regardless of age
+        if len(activities) >= 10 and self._validate_cache_integrity(cache_data):  # Reasonable threshold
+            logger.info(f"Cache has complete data ({len(activities)} activities), considering valid despite age")
+            # Re-checked at most once a minute (integrity depends on the current month)
+            self._cache_valid_memo = (memo_key, now + timedelta(seconds=60))
+            return True
         
-        return True
+        return False
     
     def _should_refresh_cache(self, cache_data: Dict[str, Any]) -> Tuple[bool, str]:
         """Cache refresh check - disabled since activities are imported manually"""
@@ -393,33 +635,28 @@ class ActivityCache:
         # Always return False - no automatic refresh needed
         return False
     
-    
-
-
     def _calculate_bounds_from_polyline(self, polyline_string: str) -> Dict[str, float]:
         """Calculate bounds from polyline string using polyline library"""
+        # Reject empty or malformed strings before paying for a full decode
+        if not polyline_string or not POLYLINE_CHARS_PATTERN.fullmatch(polyline_string):
+            return {}
+        
         try:
-            import polyline
-            
-            # Decode polyline to get coordinates
-            coordinates = polyline.decode(polyline_string)
+            # Bounds are memoized per polyline string - a fresh dict per call so callers can't alter the cache
+            cached_bounds = _polyline_bounds_cached(polyline_string)
             
-            if not coordinates:
+            if cached_bounds is None:
                 return {}
             
-            # Extract latitudes and longitudes
-            lats = [coord[0] for coord in coordinates]
-            lngs = [coord[1] for coord in coordinates]
-            
-            # Calculate bounds
+            south, north, west, east = cached_bounds
             bounds = {
-                "south": min(lats),
-                "north": max(lats),
-                "west": min(lngs),
-                "east": max(lngs)
+                "south": south,
+                "north": north,
+                "west": west,
+                "east": east
             }
             
-            logger.debug(f"🗺️ Calculated bounds: {bounds}")
+            logger.debug("🗺️ Calculated bounds: %s", bounds)
             return bounds
             
         except Exception as e:
@@ -427,27 +664,6 @@ class ActivityCache:
             return {}
 
 
-    def _has_music_patterns(self, description: str) -> bool:
-        """Check if description contains music detection patterns"""
-        if not description:
-            return False
-        
-        # Music detection patterns
-        album_pattern = r"Album:\s*([^,\n]+?)\s+by\s+([^,\n]+)"
-        russell_radio_pattern = r"Russell Radio:\s*([^,\n]+?)\s+by\s+([^,\n]+)"
-        track_pattern = r"Track:\s*([^,\n]+?)\s+by\s+([^,\n]+)"
-        playlist_pattern = r"Playlist:\s*([^,\n]+)"
-        
-        return (bool(re.search(album_pattern, description, re.IGNORECASE)) or
-                bool(re.search(russell_radio_pattern, description, re.IGNORECASE)) or
-                bool(re.search(track_pattern, description, re.IGNORECASE)) or
-                bool(re.search(playlist_pattern, description, re.IGNORECASE)))
-
-
-    
-    
-    
-    
     def _validate_cache_integrity_for_corruption(self, activities: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Validate cache data integrity - check for missing or invalid fields"""
         corrupted_activities = []
@@ -457,17 +673,27 @@ class ActivityCache:
             if not activity_id:
                 continue
             
+            # Look each field up once per activity
+            name = activity.get("name")
+            distance = activity.get("distance")
+            map_data = activity.get("map")
+            
+            # Fast path - healthy activities (the common case) pass all checks in one expression
+            if (name and distance is not None and distance != 0 and
+                    (not map_data or map_data.get("polyline") or map_data.get("bounds"))):
+                continue
+            
+            # Only a failing activity pays for working out which checks failed
             corruption_reasons = []
             
             # Check for missing essential fields
-            if not activity.get("name"):
+            if not name:
                 corruption_reasons.append("missing_name")
             
-            if activity.get("distance") is None or activity.get("distance") == 0:
+            if distance is None or distance == 0:
                 corruption_reasons.append("missing_or_zero_distance")
             
             # Check for invalid map data
-            map_data = activity.get("map", {})
             if map_data and not map_data.get("polyline") and not map_data.get("bounds"):
                 corruption_reasons.append("invalid_map_data")
             
@@ -477,7 +703,7 @@ class ActivityCache:
                     "name": activity.get("name", "Unknown"),
                     "reasons": corruption_reasons
                 })
-                logger.warning(f"🚨 Data integrity issue in activity {activity_id}: {corruption_reasons}")
+                logger.warning("🚨 Data integrity issue in activity %s: %s", activity_id, corruption_reasons)
         
         return {
             "corruption_detected": len(corrupted_activities) > 0,
@@ -489,15 +715,18 @@ class ActivityCache:
     def _schedule_daily_corruption_check(self):
         """Schedule daily corruption check at 2am using internal scheduler"""
         try:
-            import schedule
-            import threading
+            import schedule  # Only needed once at startup
             
             def corruption_check_worker():
-                schedule.every().day.at("02:00").do(self._daily_corruption_check)
+                # Own scheduler instance so repeated startups never stack jobs on the global one
+                scheduler = schedule.Scheduler()
+                scheduler.every().day.at("02:00").do(self._daily_corruption_check)
                 
-                while True:
-                    schedule.run_pending()
-                    time.sleep(60)  # Check every minute
+                while not self._shutdown_event.is_set():
+                    scheduler.run_pending()
+                    # Sleep until the next run (capped at 1h to pick up clock/DST changes), returning at once on shutdown
+                    idle = scheduler.idle_seconds
+                    self._shutdown_event.wait(3600 if idle is None else min(max(idle, 0), 3600))
             
             # Start scheduler in background thread
             scheduler_thread = threading.Thread(target=corruption_check_worker, daemon=True)
@@ -540,29 +769,29 @@ class ActivityCache:
                 
                 # Log details of corrupted activities
                 for corrupted in corruption_analysis["corrupted_activities"]:
-                    logger.warning(f"🚨 Activity {corrupted['id']} ({corrupted['name']}): {corrupted['reasons']}")
+                    logger.warning("🚨 Activity %s (%s): %s", corrupted['id'], corrupted['name'], corrupted['reasons'])
                 
                 # Note: Data repair requires re-importing via GPX import endpoint
                 logger.info("💡 To repair: Re-import activities via GPX import endpoint")
             else:
                 logger.info("✅ No corruption detected - database is clean")
             
-            # Step 8: Update corruption check metadata
+            # Step 8: Update corruption check metadata on a copy of the loaded data and save once
+            # (the loaded dict may still be queued for a background Supabase save)
             current_time = datetime.now().isoformat()
-            cache_data = self._load_cache(trigger_emergency_refresh=False)
-            if cache_data:
-                cache_data['last_corruption_check'] = current_time
-                cache_data['corruption_check_status'] = 'completed'
-                if corruption_analysis["corruption_detected"]:
-                    cache_data['last_corruption_detected'] = current_time
-                    cache_data['corrupted_activities_count'] = len(corruption_analysis["corrupted_activities"])
-                self._save_cache(cache_data)
+            check_metadata = {
+                'last_corruption_check': current_time,
+                'corruption_check_status': 'completed'
+            }
+            if corruption_analysis["corruption_detected"]:
+                check_metadata['last_corruption_detected'] = current_time
+                check_metadata['corrupted_activities_count'] = len(corruption_analysis["corrupted_activities"])
+            self._save_cache({**cache_data, **check_metadata})
             
             logger.info("✅ Daily corruption check completed successfully")
             
         except Exception as e:
             logger.error(f"❌ Daily corruption check failed: {e}")
-            import traceback
             logger.error(f"❌ Full traceback: {traceback.format_exc()}")
     
     def check_and_refresh(self):
@@ -578,7 +807,14 @@ class ActivityCache:
     def get_cache_status(self) -> Dict[str, Any]:
         """Get comprehensive cache status for monitoring"""
         try:
-            cache_data = self._load_cache()
+            # Monitoring polls often - a recently loaded in-memory snapshot is reported as is; anything
+            # older (or a missing/placeholder copy) goes through _load_cache so other workers' writes show up
+            with self._cache_lock:
+                cache_data = self._cache_data
+                loaded_at = self._cache_loaded_at
+            if (cache_data is None or loaded_at is None or
+                    (datetime.now() - loaded_at).total_seconds() >= self._status_snapshot_seconds):
+                cache_data = self._load_cache()
             should_refresh = self._should_trigger_8hour_refresh()
             reason = "8+ hours old" if should_refresh else "Cache is valid"
             
@@ -612,11 +848,51 @@ class ActivityCache:
             }
     
     
-    def _validate_user_input(self, data):
-        """Only sanitize user input fields"""
-        user_input_fields = ['comments', 'donation_messages', 'donor_names']
-        # Simplified for now - full implementation in supabase_cache_manager.py
-        return data
+    def clean_invalid_activities(self) -> Dict[str, Any]:
+        """Remove invalid/unknown activities from the cache and save once"""
+        try:
+            cache_data = self._load_cache()
+            activities = cache_data.get("activities", []) if cache_data else []
+            if not activities:
+                return {
+                    "success": True,
+                    "message": "No activities in cache to clean",
+                    "activities_removed": 0,
+                    "activities_remaining": 0
+                }
+            
+            cleaned = self._clean_invalid_activities(activities)
+            removed_count = len(activities) - len(cleaned)
+            if removed_count:
+                self._save_cache({**cache_data, "activities": cleaned})
+            
+            return {
+                "success": True,
+                "message": f"Removed {removed_count} invalid activities",
+                "activities_removed": removed_count,
+                "activities_remaining": len(cleaned)
+            }
+            
+        except Exception as e:
+            logger.error(f"❌ Failed to clean invalid activities: {e}")
+            return {
+                "success": False,
+                "message": f"Failed to clean invalid activities: {e}"
+            }
+    
+    def _clean_invalid_activities(self, activities: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Filter out invalid activities in one pass with a single summary log"""
+        allowed_types = self.allowed_activity_types
+        invalid_ids = []
+        cleaned = [
+            activity for activity in activities
+            if not (_is_invalid_activity(activity, allowed_types) and (invalid_ids.append(activity.get("id")) or True))
+        ]
+        
+        if invalid_ids:
+            logger.warning("🧹 Removing %d invalid activities: %s", len(invalid_ids), invalid_ids[:20])
+        
+        return cleaned
     
     def get_activities_smart(self, limit: int = 1000, force_refresh: bool = False) -> List[Dict[str, Any]]:
         """
@@ -640,13 +916,8 @@ class ActivityCache:
                 # Try to parse start_date_local first, fallback to start_date
                 date_str = activity.get("start_date_local") or activity.get("start_date", "")
                 if date_str:
-                    # Handle both ISO format and other formats
-                    if 'T' in date_str:
-                        from datetime import datetime
-                        return datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-                    else:
-                        from datetime import datetime
-                        return datetime.fromisoformat(date_str)
+                    # Handles both full ISO timestamps and plain dates; parsed once per distinct string
+                    return _parse_iso(date_str)
                 return datetime.min
             except (ValueError, TypeError):
                 return datetime.min
@@ -655,8 +926,7 @@ class ActivityCache:
         
         # Use cache if valid and not forcing refresh
         if not force_refresh and self._is_cache_valid(cache_data):
-            logger.info(f"Using cached data ({len(activities)} activities)")
-            logger.info(f"Cache hit - {time.time() - start_time:.3f}s")
+            logger.debug("Cache hit - using cached data (%d activities) in %.3fs", len(activities), time.time() - start_time)
             return activities[:limit]
         
         # Cache is invalid - return what we have or empty list
@@ -670,29 +940,30 @@ class ActivityCache:
     
 
     def _filter_activities(self, raw_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Filter activities to only include runs/rides from May 22nd, 2025 onwards"""
+        """Filter activities to allowed types (runs/rides) starting on or after self.start_date"""
         try:
             filtered_activities = []
-            cutoff_date = datetime(2025, 5, 22, tzinfo=timezone.utc)
+            cutoff_date = self.start_date
+            allowed_types = self.allowed_activity_types
             
             for activity in raw_data:
-                activity_type = activity.get('type', '').lower()
-                if activity_type in ['run', 'ride']:
+                # Exact-case frozenset membership, as in _is_invalid_activity - no per-activity .lower() copy
+                if activity.get('type') in allowed_types:
                     start_date_str = activity.get('start_date_local', '')
                     if start_date_str:
                         try:
-                            # Parse the date and ensure it's timezone-aware
-                            start_date = datetime.fromisoformat(start_date_str.replace('Z', '+00:00'))
+                            # Parse the date (memoized - the same dates are filtered on every refresh) and ensure it's timezone-aware
+                            start_date = _parse_iso(start_date_str)
                             if start_date.tzinfo is None:
                                 start_date = start_date.replace(tzinfo=timezone.utc)
                             
                             if start_date >= cutoff_date:
                                 filtered_activities.append(activity)
                         except Exception as e:
-                            logger.warning(f"Error parsing activity date {start_date_str}: {e}")
+                            logger.warning("Error parsing activity date %s: %s", start_date_str, e)
                             continue
             
-            logger.info(f"🔄 Filtered to {len(filtered_activities)} runs/rides from May 22nd, 2025 onwards")
+            logger.info(f"🔄 Filtered to {len(filtered_activities)} runs/rides from {cutoff_date:%B %d, %Y} onwards")
             return filtered_activities
             
         except Exception as e:
@@ -708,43 +979,50 @@ class ActivityCache:
                 logger.warning("Cache has no activities")
                 return False
             
+            # One pass counts basic data, polyline and bounds together (one map lookup per activity)
             total_activities = len(activities)
             basic_data_count = 0
+            polyline_count = 0
+            bounds_count = 0
             for activity in activities:
-                if (activity.get("id") and 
-                    activity.get("name") and 
-                    activity.get("type") and 
-                    activity.get("start_date_local")):
+                get = activity.get
+                if get("id") and get("name") and get("type") and get("start_date_local"):
                     basic_data_count += 1
+                activity_map = get("map") or EMPTY_MAP
+                if activity_map.get("polyline"):
+                    polyline_count += 1
+                if activity_map.get("bounds"):
+                    bounds_count += 1
             
             # If less than 90% of activities have basic data, consider it corrupted
             if basic_data_count < total_activities * 0.9:
-                logger.warning(f"Cache integrity check failed: Only {basic_data_count}/{total_activities} activities have basic data")
+                logger.warning("Cache integrity check failed: Only %d/%d activities have basic data",
+                               basic_data_count, total_activities)
                 return False
             
-            # Check for polyline and bounds data (Run/Ride activities should have both)
-            polyline_count = sum(1 for activity in activities if activity.get("map", {}).get("polyline"))
-            bounds_count = sum(1 for activity in activities if activity.get("map", {}).get("bounds"))
-            
             # Determine if we're in the middle of batching process
             is_emergency_refresh = cache_data.get("emergency_refresh", False)
-            is_fresh_cache = cache_data.get("timestamp") and (datetime.now() - datetime.fromisoformat(cache_data["timestamp"])).total_seconds() < 3600  # Less than 1 hour old
+            timestamp = cache_data.get("timestamp")
+            is_fresh_cache = bool(timestamp) and time.time() - _iso_epoch(timestamp) < FRESH_CACHE_SECONDS
             is_batching_in_progress = cache_data.get("batching_in_progress", False)
             
             # During emergency refresh or fresh cache, allow batching to complete
             if is_emergency_refresh or is_fresh_cache or is_batching_in_progress:
-                logger.info(f"Cache validation: Allowing batching process to complete (emergency: {is_emergency_refresh}, fresh: {is_fresh_cache}, batching: {is_batching_in_progress})")
-                logger.info(f"Cache integrity check passed: {basic_data_count}/{total_activities} activities have basic data, {polyline_count}/{total_activities} have polyline data, {bounds_count}/{total_activities} have bounds data")
+                _log_integrity_summary(
+                    basic_data_count, polyline_count, bounds_count, total_activities,
+                    batching_flags=(is_emergency_refresh, is_fresh_cache, is_batching_in_progress)
+                )
                 return True
             
             # After batching should be complete, enforce the 30% polyline threshold
-            polyline_percentage = polyline_count / total_activities if total_activities > 0 else 0
+            polyline_percentage = polyline_count / total_activities  # total_activities > 0 - empty caches returned above
             if polyline_percentage < 0.3:
-                logger.warning(f"Cache integrity check failed: Only {polyline_count}/{total_activities} activities have polyline data ({polyline_percentage:.1%} - below 30% threshold)")
-                logger.warning("This indicates batching may not have completed successfully or needs to be re-run")
+                logger.warning("Cache integrity check failed: Only %d/%d activities have polyline data (%.1f%% - below 30%% threshold); "
+                               "batching may not have completed successfully or needs to be re-run",
+                               polyline_count, total_activities, polyline_percentage * 100)
                 return False
             
-            logger.info(f"Cache integrity check passed: {basic_data_count}/{total_activities} activities have basic data, {polyline_count}/{total_activities} have polyline data, {bounds_count}/{total_activities} have bounds data")
+            _log_integrity_summary(basic_data_count, polyline_count, bounds_count, total_activities)
             return True
             
         except Exception as e:
@@ -760,132 +1038,148 @@ class ActivityCache:
                 return False
             
             total_activities = len(activities)
-            
-            # Check for basic data integrity (all activities should have basic fields)
-            basic_data_count = 0
-            for activity in activities:
-                if (activity.get("id") and 
-                    activity.get("name") and 
-                    activity.get("type") and 
-                    activity.get("start_date_local")):
-                    basic_data_count += 1
-            
-            # If less than 90% of activities have basic data, consider it corrupted
-            if basic_data_count < total_activities * 0.9:
-                logger.warning(f"Cache integrity check failed: Only {basic_data_count}/{total_activities} activities have basic data")
+            now = datetime.now()
+            recent_month = now.strftime("%Y-%m")  # Activities this month should have complete GPS data
+            
+            # Unchanged cache data that already passed the full check needs no rescan
+            integrity_key = (
+                cache_data.get("timestamp"),
+                cache_data.get("emergency_refresh", False),
+                cache_data.get("batching_in_progress", False),
+                id(activities),
+                total_activities,
+                recent_month
+            )
+            if integrity_key == self._integrity_cache_key:
+                return True
+            if integrity_key == self._integrity_failed_key:
+                return False  # Failures depend only on the keyed data, never on cache age
+            
+            # Counts stored by _save_cache are reused; otherwise scan (stopping once corruption is certain)
+            # More than 10% of activities missing basic data is corruption
+            max_missing_basic = total_activities * 0.1
+            counts = cache_data.get("_counts")
+            if not (counts and counts.get("month") == recent_month and counts.get("total") == total_activities):
+                counts = _count_integrity_coverage(activities, recent_month, max_missing_basic)
+            
+            if counts["missing_basic"] > max_missing_basic:
+                logger.warning("Cache integrity check failed: At least %d/%d activities are missing basic data", counts["missing_basic"], total_activities)
+                self._integrity_failed_key = integrity_key
                 return False
             
-            # Check for polyline and bounds data (Run/Ride activities should have both)
-            polyline_count = sum(1 for activity in activities if activity.get("map", {}).get("polyline"))
-            bounds_count = sum(1 for activity in activities if activity.get("map", {}).get("bounds"))
+            basic_data_count = total_activities - counts["missing_basic"]
+            polyline_count = counts["polyline"]
+            bounds_count = counts["bounds"]
+            recent_count = counts["recent"]
+            recent_polyline_count = counts["recent_polyline"]
+            recent_bounds_count = counts["recent_bounds"]
             
             # Determine if we're in the middle of batching process
             is_emergency_refresh = cache_data.get("emergency_refresh", False)
-            is_fresh_cache = cache_data.get("timestamp") and (datetime.now() - datetime.fromisoformat(cache_data["timestamp"])).total_seconds() < 3600  # Less than 1 hour old
+            timestamp = cache_data.get("timestamp")
+            is_fresh_cache = bool(timestamp) and time.time() - _iso_epoch(timestamp) < FRESH_CACHE_SECONDS
             is_batching_in_progress = cache_data.get("batching_in_progress", False)
             
             # During emergency refresh or fresh cache, allow batching to complete
             if is_emergency_refresh or is_fresh_cache or is_batching_in_progress:
-                logger.info(f"Cache validation: Allowing batching process to complete (emergency: {is_emergency_refresh}, fresh: {is_fresh_cache}, batching: {is_batching_in_progress})")
-                logger.info(f"Cache integrity check passed: {basic_data_count}/{total_activities} activities have basic data, {polyline_count}/{total_activities} have polyline data, {bounds_count}/{total_activities} have bounds data")
+                _log_integrity_summary(
+                    basic_data_count, polyline_count, bounds_count, total_activities,
+                    batching_flags=(is_emergency_refresh, is_fresh_cache, is_batching_in_progress)
+                )
                 return True
             
             # After batching should be complete, enforce the 30% polyline threshold
-            polyline_percentage = polyline_count / total_activities if total_activities > 0 else 0
+            polyline_percentage = polyline_count / total_activities  # total_activities > 0 - empty caches returned above
             if polyline_percentage < 0.3:
-                logger.warning(f"Cache integrity check failed: Only {polyline_count}/{total_activities} activities have polyline data ({polyline_percentage:.1%} - below 30% threshold)")
-                logger.warning("This indicates batching may not have completed successfully or needs to be re-run")
+                logger.warning("Cache integrity check failed: Only %d/%d activities have polyline data (%.1f%% - below 30%% threshold); "
+                               "batching may not have completed successfully or needs to be re-run",
+                               polyline_count, total_activities, polyline_percentage * 100)
+                self._integrity_failed_key = integrity_key
                 return False
             
             # Check for recent activities (should have complete GPS data)
-            recent_activities = [a for a in activities if a.get("start_date_local", "").startswith("2025-09")]
-            if recent_activities:
-                recent_polyline_count = sum(1 for activity in recent_activities if activity.get("map", {}).get("polyline"))
-                recent_bounds_count = sum(1 for activity in recent_activities if activity.get("map", {}).get("bounds"))
+            if recent_count:
                 # Recent Run/Ride activities should have both polyline and bounds
-                if recent_polyline_count < len(recent_activities) * 0.9:
-                    logger.warning(f"Cache integrity check failed: Recent activities missing polyline data ({recent_polyline_count}/{len(recent_activities)})")
+                if recent_polyline_count < recent_count * 0.9:
+                    logger.warning("Cache integrity check failed: Recent activities missing polyline data (%d/%d)", recent_polyline_count, recent_count)
+                    self._integrity_failed_key = integrity_key
                     return False
-                if recent_bounds_count < len(recent_activities) * 0.9:
-                    logger.warning(f"Cache integrity check failed: Recent activities missing bounds data ({recent_bounds_count}/{len(recent_activities)})")
+                if recent_bounds_count < recent_count * 0.9:
+                    logger.warning("Cache integrity check failed: Recent activities missing bounds data (%d/%d)", recent_bounds_count, recent_count)
+                    self._integrity_failed_key = integrity_key
                     return False
             
-            logger.info(f"Cache integrity check passed: {basic_data_count}/{total_activities} activities have basic data, {polyline_count}/{total_activities} have polyline data, {bounds_count}/{total_activities} have bounds data")
+            _log_integrity_summary(basic_data_count, polyline_count, bounds_count, total_activities)
+            # Only remember full passes - batching-allowance passes depend on cache age and may flip
+            self._integrity_cache_key = integrity_key
             return True
             
         except Exception as e:
-            logger.error(f"Cache integrity check error: {e}")
+            logger.error("Cache integrity check error: %s", e)
             return False
-
-
-
+    
     def _detect_music_sync(self, description: str) -> Dict[str, Any]:
         """Synchronous music detection (CPU-bound) - returns original format"""
         if not description:
             return {}
         
-        # Music detection patterns - optimized for performance
-        album_pattern = r"Album:\s*([^,\n]+?)\s+by\s+([^,\n]+)"
-        russell_radio_pattern = r"Russell Radio:\s*([^,\n]+?)\s+by\s+([^,\n]+)"
-        track_pattern = r"Track:\s*([^,\n]+?)\s+by\s+([^,\n]+)"
-        playlist_pattern = r"Playlist:\s*([^,\n]+)"
-        
         music_data = {}
         detected = {}
+        matches = find_music_matches(description)
         
         # Check for album
-        album_match = re.search(album_pattern, description, re.IGNORECASE)
-        if album_match:
+        if "album" in matches:
+            name, artist = matches["album"]
             detected = {
                 "type": "album",
-                "title": album_match.group(1).strip(),
-                "artist": album_match.group(2).strip(),
+                "title": name,
+                "artist": artist,
                 "source": "description"
             }
             music_data["album"] = {
-                "name": album_match.group(1).strip(),
-                "artist": album_match.group(2).strip()
+                "name": name,
+                "artist": artist
             }
         
         # Check for Russell Radio
-        russell_match = re.search(russell_radio_pattern, description, re.IGNORECASE)
-        if russell_match:
+        if "russell_radio" in matches:
+            name, artist = matches["russell_radio"]
             detected = {
                 "type": "track",
-                "title": russell_match.group(1).strip(),
-                "artist": russell_match.group(2).strip(),
+                "title": name,
+                "artist": artist,
                 "source": "russell_radio"
             }
             music_data["track"] = {
-                "name": russell_match.group(1).strip(),
-                "artist": russell_match.group(2).strip()
+                "name": name,
+                "artist": artist
             }
         
         # Check for track
-        track_match = re.search(track_pattern, description, re.IGNORECASE)
-        if track_match:
+        if "track" in matches:
+            name, artist = matches["track"]
             detected = {
                 "type": "track",
-                "title": track_match.group(1).strip(),
-                "artist": track_match.group(2).strip() if track_match.group(2) else None,
+                "title": name,
+                "artist": artist,
                 "source": "description"
             }
             music_data["track"] = {
-                "name": track_match.group(1).strip(),
-                "artist": track_match.group(2).strip() if track_match.group(2) else None
+                "name": name,
+                "artist": artist
             }
         
         # Check for playlist
-        playlist_match = re.search(playlist_pattern, description, re.IGNORECASE)
-        if playlist_match:
+        if "playlist" in matches:
+            name, _ = matches["playlist"]
             detected = {
                 "type": "playlist",
-                "title": playlist_match.group(1).strip(),
+                "title": name,
                 "artist": "Various Artists",
                 "source": "description"
             }
             music_data["playlist"] = {
-                "name": playlist_match.group(1).strip()
+                "name": name
             }
         
         # Add detected field for frontend compatibility
@@ -900,7 +1194,7 @@ class ActivityCache:
     def _generate_deezer_widget(self, detected: Dict[str, Any]) -> str:
         """Generate Deezer widget HTML for the detected music"""
         try:
-            logger.info(f"🎵 Generating Deezer widget for: {detected['title']} by {detected['artist']} (type: {detected['type']})")
+            logger.info("🎵 Generating Deezer widget for: %s by %s (type: %s)", detected['title'], detected['artist'], detected['type'])
             
             # Search for the track/album on Deezer
             deezer_id, id_type = self._search_deezer_for_id(
@@ -913,19 +1207,19 @@ class ActivityCache:
                 # Generate Deezer widget HTML
                 if id_type == "track":
                     widget_html = f'<iframe scrolling="no" frameborder="0" allowTransparency="true" src="https://widget.deezer.com/widget/dark/{id_type}/{deezer_id}" width="100%" height="200"></iframe>'
-                    logger.info(f"🎵 Generated Deezer track widget: {deezer_id}")
+                    logger.info("🎵 Generated Deezer track widget: %s", deezer_id)
                     return widget_html
                 elif id_type == "album":
                     widget_html = f'<iframe scrolling="no" frameborder="0" allowTransparency="true" src="https://widget.deezer.com/widget/dark/{id_type}/{deezer_id}" width="100%" height="300"></iframe>'
-                    logger.info(f"🎵 Generated Deezer album widget: {deezer_id}")
+                    logger.info("🎵 Generated Deezer album widget: %s", deezer_id)
                     return widget_html
             
             # Fallback: return a simple text representation
-            logger.warning(f"🎵 No Deezer ID found, using fallback for: {detected['title']} by {detected['artist']}")
+            logger.warning("🎵 No Deezer ID found, using fallback for: %s by %s", detected['title'], detected['artist'])
             return f'<div class="music-fallback"><p><strong>{detected["title"]}</strong> by {detected["artist"]}</p></div>'
             
         except Exception as e:
-            logger.warning(f"🎵 Failed to generate Deezer widget: {e}")
+            logger.warning("🎵 Failed to generate Deezer widget: %s", e)
             return f'<div class="music-fallback"><p><strong>{detected["title"]}</strong> by {detected["artist"]}</p></div>'
     
     def _search_deezer_for_id(self, title: str, artist: str, music_type: str) -> tuple[str, str]:
@@ -967,15 +1261,15 @@ class ActivityCache:
             for search_query in search_queries:
                 for search_endpoint, endpoint_type in search_endpoints:
                     try:
-                        encoded_query = search_query.replace(" ", "%20")
+                        encoded_query = quote_plus(search_query)
                         search_url = f"{search_endpoint}?q={encoded_query}&limit=10"
                         
-                        logger.debug(f"🎵 Searching Deezer for: {search_query} ({endpoint_type}) (URL: {search_url})")
+                        logger.debug("🎵 Searching Deezer for: %s (%s) (URL: %s)", search_query, endpoint_type, search_url)
                         
                         # Make request to Deezer API
                         response = requests.get(search_url, timeout=10)
                         if response.status_code == 200:
-                            data = response.json()
+                            data = json_loads(response.content)
                             
                             if data.get("data") and len(data["data"]) > 0:
                                 # Look for exact matches first
@@ -991,13 +1285,13 @@ class ActivityCache:
                                         if endpoint_type == "album_from_track" and music_type == "album":
                                             album_id = result.get("album", {}).get("id")
                                             if album_id:
-                                                logger.info(f"🎵 Found exact Deezer match: {result_title} by {result_artist} (track) - using album ID: {album_id}")
+                                                logger.info("🎵 Found exact Deezer match: %s by %s (track) - using album ID: %s", result_title, result_artist, album_id)
                                                 return album_id, "album"
                                             else:
-                                                logger.warning(f"🎵 Found track match but no album ID available")
+                                                logger.warning("🎵 Found track match but no album ID available")
                                                 continue
                                         else:
-                                            logger.info(f"🎵 Found exact Deezer match: {result_title} by {result_artist} ({endpoint_type}) (ID: {result['id']})")
+                                            logger.info("🎵 Found exact Deezer match: %s by %s (%s) (ID: %s)", result_title, result_artist, endpoint_type, result['id'])
                                             return result["id"], endpoint_type
                                 
                                 # If no exact match found, try partial matches
@@ -1019,13 +1313,13 @@ class ActivityCache:
                                         if endpoint_type == "album_from_track" and music_type == "album":
                                             album_id = result.get("album", {}).get("id")
                                             if album_id:
-                                                logger.info(f"🎵 Found partial Deezer match: {result_title} by {result_artist} (track) - using album ID: {album_id}")
+                                                logger.info("🎵 Found partial Deezer match: %s by %s (track) - using album ID: %s", result_title, result_artist, album_id)
                                                 return album_id, "album"
                                             else:
-                                                logger.warning(f"🎵 Found track match but no album ID available")
+                                                logger.warning("🎵 Found track match but no album ID available")
                                                 continue
                                         else:
-                                            logger.info(f"🎵 Found partial Deezer match: {result_title} by {result_artist} ({endpoint_type}) (ID: {result['id']})")
+                                            logger.info("🎵 Found partial Deezer match: %s by %s (%s) (ID: %s)", result_title, result_artist, endpoint_type, result['id'])
                                             return result["id"], endpoint_type
                                 
                                 # If still no match, return the first result as fallback
@@ -1035,23 +1329,23 @@ class ActivityCache:
                                 if endpoint_type == "album_from_track" and music_type == "album":
                                     album_id = result.get("album", {}).get("id")
                                     if album_id:
-                                        logger.warning(f"🎵 No exact match found, using first result album: {result.get('title')} by {result.get('artist', {}).get('name')} (track) - using album ID: {album_id}")
+                                        logger.warning("🎵 No exact match found, using first result album: %s by %s (track) - using album ID: %s", result.get('title'), result.get('artist', {}).get('name'), album_id)
                                         return album_id, "album"
                                     else:
-                                        logger.warning(f"🎵 Found track but no album ID available, skipping")
+                                        logger.warning("🎵 Found track but no album ID available, skipping")
                                         continue
                                 else:
-                                    logger.warning(f"🎵 No exact match found, using first result: {result.get('title')} by {result.get('artist', {}).get('name')} ({endpoint_type}) (ID: {result['id']})")
+                                    logger.warning("🎵 No exact match found, using first result: %s by %s (%s) (ID: %s)", result.get('title'), result.get('artist', {}).get('name'), endpoint_type, result['id'])
                                     return result["id"], endpoint_type
                     
                     except Exception as e:
-                        logger.debug(f"🎵 Search query failed: {search_query} ({endpoint_type}) - {e}")
+                        logger.debug("🎵 Search query failed: %s (%s) - %s", search_query, endpoint_type, e)
                         continue
             
-            logger.warning(f"🎵 No Deezer results found for: {title} by {artist}")
+            logger.warning("🎵 No Deezer results found for: %s by %s", title, artist)
             return None, None
             
         except Exception as e:
-            logger.warning(f"🎵 Failed to search Deezer API: {e}")
+            logger.warning("🎵 Failed to search Deezer API: %s", e)
             return None, None
 
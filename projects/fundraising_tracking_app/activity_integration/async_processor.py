@@ -6,23 +6,89 @@ Handles heavy operations concurrently to improve API performance
 
 import asyncio
 import logging
+import time
+import threading
+from collections import OrderedDict
 from typing import List, Dict, Any, Optional, Callable, Tuple
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, Future
 from datetime import datetime
 import re
+import hashlib
+import unicodedata
+from urllib.parse import quote_plus
+import httpx
+from .json_utils import json_loads
+from .http_clients import get_http_client
 
 logger = logging.getLogger(__name__)
 
+# Music detection patterns combined into one alternation so a description is scanned once
+# One character of a music name/artist - stops at a comma, newline or the next label on the same line,
+# so "Album: X by Y. Track: Z by W" still yields the track rather than swallowing it into the album artist
+_MUSIC_FIELD_CHAR = r"(?:(?!\b(?:Album|Track|Playlist|Russell Radio):)[^,\n])"
+MUSIC_PATTERN = re.compile(
+    rf"(?P<album>Album:\s*(?P<album_name>{_MUSIC_FIELD_CHAR}+?)\s+by\s+(?P<album_artist>{_MUSIC_FIELD_CHAR}+))"
+    rf"|(?P<russell_radio>Russell Radio:\s*(?P<russell_radio_name>{_MUSIC_FIELD_CHAR}+?)\s+by\s+(?P<russell_radio_artist>{_MUSIC_FIELD_CHAR}+))"
+    rf"|(?P<track>Track:\s*(?P<track_name>{_MUSIC_FIELD_CHAR}+?)\s+by\s+(?P<track_artist>{_MUSIC_FIELD_CHAR}+))"
+    rf"|(?P<playlist>Playlist:\s*(?P<playlist_name>{_MUSIC_FIELD_CHAR}+))",
+    re.IGNORECASE
+)
+
+# Deezer lookup cache - (title, artist, music_type) -> (deezer_id, id_type, expiry epoch)
+# Module-level so results are shared across processors; misses expire sooner than hits.
+# An LRU bounded at DEEZER_CACHE_MAX_ENTRIES so a long-running process doesn't grow it forever
+DEEZER_CACHE_TTL_SECONDS = 7 * 86400  # 7 days
+DEEZER_NEGATIVE_CACHE_TTL_SECONDS = 86400  # 24 hours
+DEEZER_CACHE_MAX_ENTRIES = 4096
+_deezer_id_cache: "OrderedDict[Tuple[str, str, str], Tuple[Any, Any, float]]" = OrderedDict()
+# Lookups currently running - concurrent activities with the same music wait on one search
+_deezer_in_flight: Dict[Tuple[str, str, str], Future] = {}
+_deezer_lock = threading.Lock()
+
+
+class DeezerLookupError(Exception):
+    """A Deezer search failed (network error, timeout, non-200) - unlike a genuine no-match it is not cached"""
+
+
+def _normalize_music_key(value: str) -> str:
+    """Lowercase and strip diacritics so 'Röyksopp' and 'Royksopp' share a cache entry"""
+    decomposed = unicodedata.normalize("NFKD", value.strip().lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def description_hash(description: str) -> str:
+    """Short stable hash of a description, stored with detected music to spot unchanged text"""
+    return hashlib.blake2b(description.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _is_searchable_music_key(key: str) -> bool:
+    """A normalized title/artist needs at least two letters or digits to be worth a Deezer search"""
+    return sum(1 for char in key if char.isalnum()) >= 2
+
+
+def find_music_matches(description: str) -> Dict[str, Tuple[str, Optional[str]]]:
+    """Return the first (name, artist) found for each music kind in a single pass"""
+    matches = {}
+    for match in MUSIC_PATTERN.finditer(description):
+        kind = match.lastgroup
+        if kind not in matches:
+            artist = match.group(f"{kind}_artist") if kind != "playlist" else None
+            matches[kind] = (match.group(f"{kind}_name").strip(), artist.strip() if artist else None)
+    return matches
+
 class AsyncProcessor:
     """
     Handles async processing of heavy operations
     Uses thread pools for CPU-bound tasks and asyncio for I/O-bound tasks
     """
     
-    def __init__(self, max_workers: int = 4):
+    def __init__(self, max_workers: int = 4, io_workers: int = 8):
         self.max_workers = max_workers
         self.executor = ThreadPoolExecutor(max_workers=max_workers)
-        logger.info(f"AsyncProcessor initialized with {max_workers} workers")
+        # Music detection blocks on Deezer HTTP calls - give it its own pool so
+        # network waits don't starve formatting, and cap concurrent Deezer requests
+        self.io_executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="deezer")
+        logger.info(f"AsyncProcessor initialized with {max_workers} workers ({io_workers} I/O workers)")
     
     async def process_activities_parallel(self, activities: List[Dict[str, Any]], 
                                         operations: List[str] = None) -> List[Dict[str, Any]]:
@@ -56,11 +122,11 @@ class AsyncProcessor:
             valid_activities = []
             for i, result in enumerate(processed_activities):
                 if isinstance(result, Exception):
-                    logger.warning(f"Failed to process activity {i}: {result}")
+                    logger.warning("Failed to process activity %s: %s", i, result)
                 else:
                     valid_activities.append(result)
             
-            logger.debug(f"Processed {len(valid_activities)}/{len(activities)} activities successfully")
+            logger.debug("Processed %d/%d activities successfully", len(valid_activities), len(activities))
             return valid_activities
             
         except Exception as e:
@@ -77,17 +143,26 @@ class AsyncProcessor:
         original_comments = activity.get('comments', [])
         
         # Run CPU-bound operations in thread pool
-        loop = asyncio.get_event_loop()
+        loop = asyncio.get_running_loop()
         
         if 'music_detection' in operations:
             description = activity.get('description', '')
             if description:
-                music_data = await loop.run_in_executor(
-                    self.executor, 
-                    self._detect_music_sync, 
-                    description
-                )
-                processed_activity['music'] = music_data
+                current_hash = description_hash(description)
+                existing_music = activity.get('music') or {}
+                if existing_music.get('widget_html') and existing_music.get('description_hash') == current_hash:
+                    # Description unchanged since the widget was generated - skip the Deezer lookup
+                    processed_activity['music'] = existing_music
+                else:
+                    music_data = await loop.run_in_executor(
+                        self.io_executor,
+                        self._detect_music_sync, 
+                        description
+                    )
+                    if music_data:
+                        music_data['description_hash'] = current_hash
+                        music_data['widget_generated_at'] = datetime.now().isoformat()
+                    processed_activity['music'] = music_data
         
         if 'photo_processing' in operations:
             photos = activity.get('photos', {})
@@ -122,7 +197,7 @@ class AsyncProcessor:
                 processed = await self._process_single_activity(activity, operations)
                 processed_activities.append(processed)
             except Exception as e:
-                logger.warning(f"Failed to process activity sequentially: {e}")
+                logger.warning("Failed to process activity sequentially: %s", e)
                 processed_activities.append(activity)  # Return original if processing fails
         
         return processed_activities
@@ -132,68 +207,63 @@ class AsyncProcessor:
         if not description:
             return {}
         
-        # Music detection patterns - optimized for performance
-        album_pattern = r"Album:\s*([^,\n]+?)\s+by\s+([^,\n]+)"
-        russell_radio_pattern = r"Russell Radio:\s*([^,\n]+?)\s+by\s+([^,\n]+)"
-        track_pattern = r"Track:\s*([^,\n]+?)\s+by\s+([^,\n]+)"
-        playlist_pattern = r"Playlist:\s*([^,\n]+)"
-        
         music_data = {}
         detected = {}
+        matches = find_music_matches(description)
         
         # Check for album
-        album_match = re.search(album_pattern, description, re.IGNORECASE)
-        if album_match:
+        if "album" in matches:
+            name, artist = matches["album"]
             detected = {
                 "type": "album",
-                "title": album_match.group(1).strip(),
-                "artist": album_match.group(2).strip(),
+                "title": name,
+                "artist": artist,
                 "source": "description"
             }
             music_data["album"] = {
-                "name": album_match.group(1).strip(),
-                "artist": album_match.group(2).strip()
+                "name": name,
+                "artist": artist
             }
         
         # Check for Russell Radio
-        russell_match = re.search(russell_radio_pattern, description, re.IGNORECASE)
-        if russell_match:
+        if "russell_radio" in matches:
+            name, artist = matches["russell_radio"]
             detected = {
                 "type": "track",
-                "title": russell_match.group(1).strip(),
-                "artist": russell_match.group(2).strip(),
+                "title": name,
+                "artist": artist,
                 "source": "russell_radio"
             }
             music_data["track"] = {
-                "name": russell_match.group(1).strip(),
-                "artist": russell_match.group(2).strip()
+                "name": name,
+                "artist": artist
             }
         
         # Check for track
-        track_match = re.search(track_pattern, description, re.IGNORECASE)
-        if track_match:
+        if "track" in matches:
+            name, artist = matches["track"]
             detected = {
                 "type": "track",
-                "title": track_match.group(1).strip(),
-                "artist": track_match.group(2).strip() if track_match.group(2) else None,
+                "title": name,
+                "artist": artist,
                 "source": "description"
             }
             music_data["track"] = {
-                "name": track_match.group(1).strip(),
-                "artist": track_match.group(2).strip() if track_match.group(2) else None
+                "name": name,
+                "artist": artist
             }
         
         # Check for playlist
-        playlist_match = re.search(playlist_pattern, description, re.IGNORECASE)
-        if playlist_match:
+        if "playlist" in matches:
+            name, _ = matches["playlist"]
             detected = {
                 "type": "playlist",
-                "title": playlist_match.group(1).strip(),
+                "title": name,
                 "artist": "Various Artists",
                 "source": "description"
             }
             music_data["playlist"] = {
-                "name": playlist_match.group(1).strip()
+                "name": name
             }
         
         # Add detected field for frontend compatibility
@@ -226,21 +296,81 @@ class AsyncProcessor:
             return f'<div class="music-fallback"><p><strong>{detected["title"]}</strong> by {detected["artist"]}</p></div>'
             
         except Exception as e:
-            logger.warning(f"Failed to generate Deezer widget: {e}")
+            logger.warning("Failed to generate Deezer widget: %s", e)
             return f'<div class="music-fallback"><p><strong>{detected["title"]}</strong> by {detected["artist"]}</p></div>'
     
     def _search_deezer_for_id(self, title: str, artist: str, music_type: str) -> tuple[str, str]:
+        """
+        Search Deezer for an album/track ID, reusing cached results for repeat lookups
+        Returns: (deezer_id, id_type) or (None, None) if not found
+        """
+        cache_key = (_normalize_music_key(title), _normalize_music_key(artist), music_type)
+        if not (_is_searchable_music_key(cache_key[0]) and _is_searchable_music_key(cache_key[1])):
+            # Punctuation-only or single-character names never match - skip the round-trip
+            logger.debug("🎵 Skipping Deezer search for unsearchable music: %s by %s", title, artist)
+            return None, None
+        
+        with _deezer_lock:
+            cached = _deezer_id_cache.get(cache_key)
+            if cached and cached[2] > time.time():
+                _deezer_id_cache.move_to_end(cache_key)
+                logger.debug("🎵 Deezer cache hit for: %s by %s", title, artist)
+                return cached[0], cached[1]
+            
+            in_flight = _deezer_in_flight.get(cache_key)
+            if in_flight is None:
+                in_flight = _deezer_in_flight[cache_key] = Future()
+                is_owner = True
+            else:
+                is_owner = False
+        
+        if not is_owner:
+            # Another activity in this batch is already searching for the same music
+            return in_flight.result()
+        
+        result = (None, None)
+        try:
+            result = self._query_deezer_for_id(title, artist, music_type)
+            ttl = DEEZER_CACHE_TTL_SECONDS if result[0] else DEEZER_NEGATIVE_CACHE_TTL_SECONDS
+            with _deezer_lock:
+                _deezer_id_cache[cache_key] = (result[0], result[1], time.time() + ttl)
+                _deezer_id_cache.move_to_end(cache_key)
+                if len(_deezer_id_cache) > DEEZER_CACHE_MAX_ENTRIES:
+                    _deezer_id_cache.popitem(last=False)
+        except DeezerLookupError as e:
+            # Transient failure - no widget this time, but the next import searches again
+            logger.warning("🎵 Deezer lookup failed for %s by %s, not caching: %s", title, artist, e)
+        finally:
+            with _deezer_lock:
+                _deezer_in_flight.pop(cache_key, None)
+            in_flight.set_result(result)
+        return result
+    
+    def _query_deezer_for_id(self, title: str, artist: str, music_type: str) -> tuple[str, str]:
         """
         Search Deezer API for specific album/track ID with sophisticated matching
         Returns: (id_type, deezer_id) or (None, None) if not found
+        Raises DeezerLookupError when nothing matched and a search request failed
         """
+        request_failed = False
         try:
-            import requests
+            # Reuse the shared pooled HTTP/2 client so every query after the first skips the TLS handshake
+            try:
+                http_client = get_http_client()
+            except RuntimeError:
+                # Outside the app lifespan (e.g. scripts) - fall back to one-off requests
+                http_client = httpx
             
             # Clean and prepare search query
             clean_title = title.strip().replace('"', '').replace("'", "")
             clean_artist = artist.strip().replace('"', '').replace("'", "")
             
+            # Lowercased forms and word sets are fixed for the whole search - build them once
+            title_lower = clean_title.lower()
+            artist_lower = clean_artist.lower()
+            title_words = set(title_lower.split())
+            artist_words = set(artist_lower.split())
+            
             # Try multiple search strategies with more flexible terms
             search_queries = [
                 f"{clean_title} {clean_artist}",      # Simple concatenation (most effective)
@@ -270,47 +400,45 @@ class AsyncProcessor:
             for search_query in search_queries:
                 for search_endpoint, endpoint_type in search_endpoints:
                     try:
-                        encoded_query = search_query.replace(" ", "%20")
+                        encoded_query = quote_plus(search_query)
                         search_url = f"{search_endpoint}?q={encoded_query}&limit=10"
                         
-                        logger.debug(f"🎵 Searching Deezer for: {search_query} ({endpoint_type}) (URL: {search_url})")
+                        logger.debug("🎵 Searching Deezer for: %s (%s) (URL: %s)", search_query, endpoint_type, search_url)
                         
                         # Make request to Deezer API
-                        response = requests.get(search_url, timeout=10)
+                        response = http_client.get(search_url, timeout=10)
                         if response.status_code == 200:
-                            data = response.json()
+                            data = json_loads(response.content)
                             
                             if data.get("data") and len(data["data"]) > 0:
+                                # Lowercase each result once for both matching passes
+                                candidates = [
+                                    (result, result.get("title", "").lower(), result.get("artist", {}).get("name", "").lower())
+                                    for result in data["data"]
+                                ]
+                                
                                 # Look for exact matches first
-                                for result in data["data"]:
-                                    result_title = result.get("title", "").lower()
-                                    result_artist = result.get("artist", {}).get("name", "").lower()
-                                    
+                                for result, result_title, result_artist in candidates:
                                     # Check for exact match
-                                    if (clean_title.lower() in result_title and clean_artist.lower() in result_artist) or \
-                                       (clean_artist.lower() in result_title and clean_title.lower() in result_artist):
+                                    if (title_lower in result_title and artist_lower in result_artist) or \
+                                       (artist_lower in result_title and title_lower in result_artist):
                                         
                                         # If we found a track but need an album, get the album ID
                                         if endpoint_type == "album_from_track" and music_type == "album":
                                             album_id = result.get("album", {}).get("id")
                                             if album_id:
-                                                logger.info(f"🎵 Found exact Deezer match: {result_title} by {result_artist} (track) - using album ID: {album_id}")
+                                                logger.info("🎵 Found exact Deezer match: %s by %s (track) - using album ID: %s", result_title, result_artist, album_id)
                                                 return album_id, "album"
                                             else:
-                                                logger.warning(f"🎵 Found track match but no album ID available")
+                                                logger.warning("🎵 Found track match but no album ID available")
                                                 continue
                                         else:
-                                            logger.info(f"🎵 Found exact Deezer match: {result_title} by {result_artist} ({endpoint_type}) (ID: {result['id']})")
+                                            logger.info("🎵 Found exact Deezer match: %s by %s (%s) (ID: %s)", result_title, result_artist, endpoint_type, result['id'])
                                             return result["id"], endpoint_type
                                 
                                 # If no exact match found, try partial matches
-                                for result in data["data"]:
-                                    result_title = result.get("title", "").lower()
-                                    result_artist = result.get("artist", {}).get("name", "").lower()
-                                    
+                                for result, result_title, result_artist in candidates:
                                     # Check for partial match (at least 80% of words match)
-                                    title_words = set(clean_title.lower().split())
-                                    artist_words = set(clean_artist.lower().split())
                                     result_title_words = set(result_title.split())
                                     result_artist_words = set(result_artist.split())
                                     
@@ -322,13 +450,13 @@ class AsyncProcessor:
                                         if endpoint_type == "album_from_track" and music_type == "album":
                                             album_id = result.get("album", {}).get("id")
                                             if album_id:
-                                                logger.info(f"🎵 Found partial Deezer match: {result_title} by {result_artist} (track) - using album ID: {album_id}")
+                                                logger.info("🎵 Found partial Deezer match: %s by %s (track) - using album ID: %s", result_title, result_artist, album_id)
                                                 return album_id, "album"
                                             else:
-                                                logger.warning(f"🎵 Found track match but no album ID available")
+                                                logger.warning("🎵 Found track match but no album ID available")
                                                 continue
                                         else:
-                                            logger.info(f"🎵 Found partial Deezer match: {result_title} by {result_artist} ({endpoint_type}) (ID: {result['id']})")
+                                            logger.info("🎵 Found partial Deezer match: %s by %s (%s) (ID: %s)", result_title, result_artist, endpoint_type, result['id'])
                                             return result["id"], endpoint_type
                                 
                                 # If still no match, return the first result as fallback
@@ -338,25 +466,32 @@ class AsyncProcessor:
                                 if endpoint_type == "album_from_track" and music_type == "album":
                                     album_id = result.get("album", {}).get("id")
                                     if album_id:
-                                        logger.warning(f"🎵 No exact match found, using first result album: {result.get('title')} by {result.get('artist', {}).get('name')} (track) - using album ID: {album_id}")
+                                        logger.warning("🎵 No exact match found, using first result album: %s by %s (track) - using album ID: %s", result.get('title'), result.get('artist', {}).get('name'), album_id)
                                         return album_id, "album"
                                     else:
-                                        logger.warning(f"🎵 Found track but no album ID available, skipping")
+                                        logger.warning("🎵 Found track but no album ID available, skipping")
                                         continue
                                 else:
-                                    logger.warning(f"🎵 No exact match found, using first result: {result.get('title')} by {result.get('artist', {}).get('name')} ({endpoint_type}) (ID: {result['id']})")
+                                    logger.warning("🎵 No exact match found, using first result: %s by %s (%s) (ID: %s)", result.get('title'), result.get('artist', {}).get('name'), endpoint_type, result['id'])
                                     return result["id"], endpoint_type
+                        else:
+                            request_failed = True
+                            logger.debug("🎵 Search query returned HTTP %s: %s (%s)", response.status_code, search_query, endpoint_type)
                     
                     except Exception as e:
-                        logger.debug(f"🎵 Search query failed: {search_query} ({endpoint_type}) - {e}")
+                        request_failed = True
+                        logger.debug("🎵 Search query failed: %s (%s) - %s", search_query, endpoint_type, e)
                         continue
             
-            logger.warning(f"🎵 No Deezer results found for: {title} by {artist}")
-            return None, None
-            
         except Exception as e:
-            logger.warning(f"Failed to search Deezer API: {e}")
-            return None, None
+            raise DeezerLookupError(f"Failed to search Deezer API: {e}") from e
+        
+        if request_failed:
+            # Some searches never got an answer - a match may exist, so this isn't a real miss
+            raise DeezerLookupError(f"Deezer searches failed for: {title} by {artist}")
+        
+        logger.warning("🎵 No Deezer results found for: %s by %s", title, artist)
+        return None, None
     
     def _process_photos_sync(self, photos: Dict[str, Any]) -> Dict[str, Any]:
         """Synchronous photo processing (CPU-bound)"""
@@ -469,11 +604,11 @@ class AsyncProcessor:
             valid_donations = []
             for i, result in enumerate(processed_donations):
                 if isinstance(result, Exception):
-                    logger.warning(f"Failed to process donation {i}: {result}")
+                    logger.warning("Failed to process donation %s: %s", i, result)
                 else:
                     valid_donations.append(result)
             
-            logger.debug(f"Processed {len(valid_donations)}/{len(donations)} donations successfully")
+            logger.debug("Processed %d/%d donations successfully", len(valid_donations), len(donations))
             return valid_donations
             
         except Exception as e:
@@ -486,7 +621,7 @@ class AsyncProcessor:
         processed_donation = donation.copy()
         
         # Run CPU-bound operations in thread pool
-        loop = asyncio.get_event_loop()
+        loop = asyncio.get_running_loop()
         
         formatted_donation = await loop.run_in_executor(
             self.executor,
@@ -504,7 +639,7 @@ class AsyncProcessor:
                 processed = await self._process_single_donation(donation)
                 processed_donations.append(processed)
             except Exception as e:
-                logger.warning(f"Failed to process donation sequentially: {e}")
+                logger.warning("Failed to process donation sequentially: %s", e)
                 processed_donations.append(donation)  # Return original if processing fails
         
         return processed_donations
@@ -553,8 +688,9 @@ class AsyncProcessor:
         return formatted
     
     def shutdown(self):
-        """Shutdown the thread pool executor"""
+        """Shutdown the thread pool executors"""
         self.executor.shutdown(wait=True)
+        self.io_executor.shutdown(wait=True)
         logger.info("AsyncProcessor shutdown complete")
 
 # Global instance
@@ -5,12 +5,19 @@ Reads activity data from Google Sheets (GPX imports) and processes it into activ
 """
 
 import os
+import re
+import time
 import logging
+import threading
+from collections import OrderedDict
 import xml.etree.ElementTree as ET
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 import polyline
 import base64
+import httpx
+from math import radians, sin, cos, sqrt, atan2
+from .http_clients import get_http_client
 
 logger = logging.getLogger(__name__)
 
@@ -31,6 +38,44 @@ except ImportError:
     GPXPY_AVAILABLE = False
     logger.warning("gpxpy not available - install with: pip install gpxpy")
 
+# Encoded polylines store coordinates to 5 decimal places
+POLYLINE_PRECISION = 5
+
+# Negative cache for GPX sources that returned 404 - (source, identifier) -> expiry epoch
+# Module-level because a new GPXImporter is created per request; an LRU bounded at
+# NEGATIVE_CACHE_MAX_ENTRIES so a long-running process doesn't grow it forever
+NEGATIVE_CACHE_TTL_SECONDS = 86400  # 24 hours
+NEGATIVE_CACHE_MAX_ENTRIES = 4096
+_negative_cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+_negative_cache_lock = threading.Lock()
+
+
+def _is_negatively_cached(source: str, identifier: str) -> bool:
+    """Check if a GPX source is known to be missing (and the entry hasn't expired)"""
+    key = (source, identifier)
+    with _negative_cache_lock:
+        expiry = _negative_cache.get(key)
+        if expiry is None:
+            return False
+        if expiry <= time.time():
+            del _negative_cache[key]
+            return False
+        _negative_cache.move_to_end(key)
+        return True
+
+
+def _mark_negatively_cached(source: str, identifier: str):
+    """Remember a missing GPX source so refreshes don't re-request it"""
+    now = time.time()
+    with _negative_cache_lock:
+        _negative_cache[(source, identifier)] = now + NEGATIVE_CACHE_TTL_SECONDS
+        _negative_cache.move_to_end((source, identifier))
+        # Drop expired entries from the least recently used end, then enforce the size cap
+        while _negative_cache and next(iter(_negative_cache.values())) <= now:
+            _negative_cache.popitem(last=False)
+        while len(_negative_cache) > NEGATIVE_CACHE_MAX_ENTRIES:
+            _negative_cache.popitem(last=False)
+
 
 class GPXImporter:
     """Import and process GPX files from Google Sheets"""
@@ -191,65 +236,57 @@ class GPXImporter:
             # Get the first track (main activity)
             track = gpx.tracks[0]
             
-            # Extract all points
-            points = []
+            # Extract coordinates as parallel lists (struct-of-arrays) - no per-point dicts
+            lats: List[float] = []
+            lngs: List[float] = []
+            start_time = None
+            end_time = None
             total_distance = 0
             total_elevation_gain = 0
-            prev_point = None
+            prev_lat_rad = prev_lng_rad = prev_cos_lat = prev_elevation = None
             
             for segment in track.segments:
                 for point in segment.points:
-                    points.append({
-                        'lat': point.latitude,
-                        'lng': point.longitude,
-                        'elevation': point.elevation,
-                        'time': point.time
-                    })
+                    lat, lng, elevation = point.latitude, point.longitude, point.elevation
+                    lat_rad, lng_rad = radians(lat), radians(lng)
+                    cos_lat = cos(lat_rad)
                     
-                    # Calculate distance
-                    if prev_point:
-                        from math import radians, sin, cos, sqrt, atan2
-                        lat1, lon1 = radians(prev_point['lat']), radians(prev_point['lng'])
-                        lat2, lon2 = radians(point.latitude), radians(point.longitude)
-                        
-                        dlat = lat2 - lat1
-                        dlon = lon2 - lon1
-                        a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
+                    if lats:
+                        # Calculate distance (haversine) - reuse the previous point's radians and cosine
+                        dlat = lat_rad - prev_lat_rad
+                        dlon = lng_rad - prev_lng_rad
+                        a = sin(dlat/2)**2 + prev_cos_lat * cos_lat * sin(dlon/2)**2
                         c = 2 * atan2(sqrt(a), sqrt(1-a))
-                        distance = 6371000 * c  # Earth radius in meters
-                        total_distance += distance
+                        total_distance += 6371000 * c  # Earth radius in meters
                         
                         # Calculate elevation gain
-                        if point.elevation and prev_point['elevation']:
-                            elevation_diff = point.elevation - prev_point['elevation']
+                        if elevation and prev_elevation:
+                            elevation_diff = elevation - prev_elevation
                             if elevation_diff > 0:
                                 total_elevation_gain += elevation_diff
+                    else:
+                        start_time = point.time
                     
-                    prev_point = {'lat': point.latitude, 'lng': point.longitude, 'elevation': point.elevation}
+                    end_time = point.time
+                    lats.append(lat)
+                    lngs.append(lng)
+                    prev_lat_rad, prev_lng_rad, prev_cos_lat, prev_elevation = lat_rad, lng_rad, cos_lat, elevation
             
             # Calculate duration
-            start_time = points[0]['time'] if points else None
-            end_time = points[-1]['time'] if points else None
             duration = (end_time - start_time).total_seconds() if start_time and end_time else 0
             
-            # Create polyline
-            if points:
-                polyline_points = [(p['lat'], p['lng']) for p in points]
-                encoded_polyline = polyline.encode(polyline_points)
-            else:
-                encoded_polyline = None
-            
-            # Calculate bounds
-            if points:
-                lats = [p['lat'] for p in points]
-                lngs = [p['lng'] for p in points]
+            # Create polyline and bounds straight from the coordinate arrays
+            if lats:
+                encoded_polyline = polyline.encode(list(zip(lats, lngs)))
+                # Round to the polyline's 5 decimal places (~1 m) - extra digits are noise in the stored JSON
                 bounds = {
-                    'north': max(lats),
-                    'south': min(lats),
-                    'east': max(lngs),
-                    'west': min(lngs)
+                    'north': round(max(lats), POLYLINE_PRECISION),
+                    'south': round(min(lats), POLYLINE_PRECISION),
+                    'east': round(max(lngs), POLYLINE_PRECISION),
+                    'west': round(min(lngs), POLYLINE_PRECISION)
                 }
             else:
+                encoded_polyline = None
                 bounds = None
             
             return {
@@ -261,7 +298,7 @@ class GPXImporter:
                 'polyline': encoded_polyline,
                 'bounds': bounds,
                 'start_time': start_time.isoformat() if start_time else None,
-                'point_count': len(points)
+                'point_count': len(lats)
             }
             
         except Exception as e:
@@ -284,7 +321,7 @@ class GPXImporter:
                     try:
                         with open(gpx_file_path, 'r') as f:
                             gpx_content = f.read()
-                        logger.info(f"✅ Read GPX from file: {gpx_file_path}")
+                        logger.debug("✅ Read GPX from file: %s", gpx_file_path)
                     except Exception as e:
                         logger.warning(f"Failed to read GPX file {gpx_file_path}: {e}")
             
@@ -316,7 +353,6 @@ class GPXImporter:
             photo_urls_str = sheet_activity.get('photos', '') or sheet_activity.get('photo_urls', '')
             if photo_urls_str:
                 # Split comma-separated URLs (handle line breaks too)
-                import re
                 photo_urls = re.split(r'[,\n]+', photo_urls_str)
                 for url in photo_urls:
                     url = url.strip()
@@ -340,7 +376,9 @@ class GPXImporter:
                         }
                     })
             
-            # Build activity object
+            # Build activity object (start time and fallback clock read shared by both date fields)
+            start_time = gpx_data.get('start_time')
+            now_iso = datetime.now().isoformat()
             activity = {
                 'id': int(sheet_activity.get('id', 0)) if sheet_activity.get('id') else None,
                 'name': sheet_activity.get('name', 'Activity').replace('_', ' '),
@@ -349,8 +387,8 @@ class GPXImporter:
                 'moving_time': gpx_data.get('moving_time', 0),
                 'elapsed_time': gpx_data.get('elapsed_time', 0),
                 'total_elevation_gain': gpx_data.get('total_elevation_gain', 0),
-                'start_date': gpx_data.get('start_time') or sheet_activity.get('start_date', datetime.now().isoformat()),
-                'start_date_local': gpx_data.get('start_time') or sheet_activity.get('start_date_local', datetime.now().isoformat()),
+                'start_date': start_time or sheet_activity.get('start_date', now_iso),
+                'start_date_local': start_time or sheet_activity.get('start_date_local', now_iso),
                 'description': sheet_activity.get('description', ''),
                 'polyline': gpx_data.get('polyline'),
                 'bounds': gpx_data.get('bounds'),
@@ -359,7 +397,7 @@ class GPXImporter:
                 'source': 'gpx_import'
             }
             
-            logger.info(f"✅ Processed GPX activity: {activity.get('name')}")
+            logger.debug("✅ Processed GPX activity: %s", activity.get('name'))
             return activity
             
         except Exception as e:
@@ -369,6 +407,10 @@ class GPXImporter:
     def _download_from_google_drive(self, file_id: str) -> str:
         """Download GPX file from Google Drive by file ID"""
         try:
+            if _is_negatively_cached('drive', file_id):
+                logger.debug("Skipping Google Drive file known to be missing: %s", file_id)
+                return ''
+            
             if not self.drive_service:
                 logger.error("Google Drive service not available")
                 return ''
@@ -386,9 +428,13 @@ class GPXImporter:
                     status, done = downloader.next_chunk()
                 
                 gpx_content = file.getvalue().decode('utf-8')
-                logger.info(f"✅ Downloaded GPX from Google Drive: {file_id}")
+                logger.debug("✅ Downloaded GPX from Google Drive: %s", file_id)
                 return gpx_content
             except Exception as e:
+                if getattr(getattr(e, 'resp', None), 'status', None) == 404:
+                    logger.warning("Google Drive file not found, skipping for 24h: %s", file_id)
+                    _mark_negatively_cached('drive', file_id)
+                    return ''
                 logger.warning(f"Could not use Drive API, trying direct download: {e}")
                 # Fallback: Direct download URL
                 download_url = f"https://drive.google.com/uc?export=download&id={file_id}"
@@ -400,13 +446,27 @@ class GPXImporter:
     
     def _download_from_url(self, url: str) -> str:
         """Download GPX file from URL (handles redirects)"""
+        if _is_negatively_cached('url', url):
+            logger.debug("Skipping GPX URL known to be missing: %s", url)
+            return ''
+        
         try:
-            import httpx
+            # Reuse the shared pooled HTTP/2 client so consecutive downloads skip the TLS handshake
+            try:
+                http_client = get_http_client()
+            except RuntimeError:
+                # Outside the app lifespan (e.g. scripts) - fall back to a one-off request
+                http_client = httpx
+            
             # Follow redirects automatically
-            response = httpx.get(url, timeout=30, follow_redirects=True)
+            response = http_client.get(url, timeout=30, follow_redirects=True)
+            if response.status_code == 404:
+                logger.warning("GPX URL not found, skipping for 24h: %s", url)
+                _mark_negatively_cached('url', url)
+                return ''
             response.raise_for_status()
             gpx_content = response.text
-            logger.info(f"✅ Downloaded GPX from URL: {url}")
+            logger.debug("✅ Downloaded GPX from URL: %s", url)
             return gpx_content
         except Exception as e:
             logger.error(f"❌ Failed to download from URL {url}: {e}")
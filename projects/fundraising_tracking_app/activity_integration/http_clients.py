@@ -36,8 +36,8 @@ async def lifespan_http_clients(app):
         ),
         # Enable HTTP/2 for better performance
         http2=True,
-        # Enable compression
-        headers={"Accept-Encoding": "gzip, deflate, br"}
+        # Enable compression - only codecs httpx decodes without optional packages (br needs brotli)
+        headers={"Accept-Encoding": "gzip, deflate"}
     )
     
     # Create async HTTP client with optimized settings
@@ -50,8 +50,8 @@ async def lifespan_http_clients(app):
         ),
         # Enable HTTP/2 for better performance
         http2=True,
-        # Enable compression
-        headers={"Accept-Encoding": "gzip, deflate, br"}
+        # Enable compression - only codecs httpx decodes without optional packages (br needs brotli)
+        headers={"Accept-Encoding": "gzip, deflate"}
     )
     
     logger.info("HTTP clients initialized with connection pooling")
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+JSON utilities for cache serialization.
+Uses orjson when it is installed and falls back to the standard library.
+"""
+
+import json
+import logging
+from typing import Any, Union
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    logger.warning("orjson not available - using stdlib json (install with: pip install orjson)")
+
+
+def json_dumps_bytes(data: Any) -> bytes:
+    """Serialize data to compact UTF-8 JSON bytes."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def json_loads(data: Union[bytes, str]) -> Any:
+    """Deserialize JSON from bytes or str."""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -5,7 +5,6 @@ Handles persistent cache storage with comprehensive security measures
 """
 
 import os
-import json
 import logging
 import hashlib
 import hmac
@@ -15,7 +14,8 @@ import ipaddress
 import re
 import httpx
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, Tuple
+from typing import Callable, Dict, Any, Optional, Tuple
+from .json_utils import json_dumps_bytes, json_loads
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +28,9 @@ class SecureSupabaseCacheManager:
         self.enabled = os.getenv("SUPABASE_ENABLED", "false").lower() == "true"
         self.base_url: Optional[str] = None
         self.headers: Optional[Dict[str, str]] = None
+        self._upsert_headers: Optional[Dict[str, str]] = None
+        self._project_ids: Dict[str, int] = {}  # project name -> id, resolved once per process
+        self._client: Optional[httpx.Client] = None  # Pooled keep-alive client shared by every Supabase call
         self._lock = threading.Lock()
         
         # Security configurations
@@ -36,6 +39,7 @@ class SecureSupabaseCacheManager:
         self.rate_limit_window = 60  # seconds
         self.rate_limit_requests = 100  # per window
         self._request_counts = {}
+        self._rate_limit_lock = threading.Lock()  # Request handler threads share the per-IP counters
         
         # API key validation
         self.api_key_hash = self._hash_api_key(os.getenv("SUPABASE_SERVICE_KEY", ""))
@@ -45,6 +49,8 @@ class SecureSupabaseCacheManager:
         self._supabase_retry_thread = None
         self._shutdown_in_progress = False
         self._retry_lock = threading.Lock()  # Thread safety for retry queue
+        self._pending_saves_event = threading.Event()  # Wakes the retry thread when work is queued
+        self.retry_backoff_seconds = 300  # 5 minutes between attempts for a failing save
         
         if self.enabled:
             self._initialize_supabase()
@@ -55,12 +61,24 @@ class SecureSupabaseCacheManager:
         if self.enabled and not self._supabase_retry_thread:
             self._start_background_retry_thread()
     
+    def background_saves_running(self) -> bool:
+        """Whether the retry thread is up to perform queued (write-behind) saves"""
+        return (self._supabase_retry_thread is not None and self._supabase_retry_thread.is_alive()
+                and not self._shutdown_in_progress)
+    
+    def has_pending_save(self, cache_type: str, project_id: str = "fundraising-app") -> bool:
+        """Whether a save for this cache is queued or still being uploaded by the retry thread"""
+        with self._retry_lock:
+            return any(item['cache_type'] == cache_type and item['project_id'] == project_id
+                       for item in self._pending_supabase_saves)
+    
     def _hash_api_key(self, api_key: str) -> str:
         """Create hash of API key for validation"""
         return hashlib.sha256(api_key.encode()).hexdigest()
     
-    def _validate_input(self, cache_type: str, data: Dict[str, Any]) -> Tuple[bool, str]:
-        """Validate input data for security"""
+    def _validate_input(self, cache_type: str, data: Dict[str, Any],
+                        encoded_size: Optional[int] = None) -> Tuple[bool, str]:
+        """Validate input data for security (encoded_size: caller's own JSON length of data, if already encoded)"""
         # Validate cache type
         if cache_type not in self.allowed_cache_types:
             return False, f"Invalid cache type: {cache_type}"
@@ -70,7 +88,7 @@ class SecureSupabaseCacheManager:
             return False, "Data must be a dictionary"
         
         # Check data size
-        data_size = len(json.dumps(data))
+        data_size = encoded_size if encoded_size is not None else len(json_dumps_bytes(data))
         if data_size > self.max_data_size:
             return False, f"Data too large: {data_size} bytes (max: {self.max_data_size})"
         
@@ -157,26 +175,26 @@ class SecureSupabaseCacheManager:
         return sanitize_value(data)
     
     def _check_rate_limit(self, client_ip: str) -> bool:
-        """Implement rate limiting"""
-        now = time.time()
-        window_start = now - self.rate_limit_window
-        
-        # Clean old entries
-        self._request_counts = {
-            ip: count for ip, count in self._request_counts.items()
-            if count['window_start'] > window_start
-        }
-        
-        # Check current IP
-        if client_ip not in self._request_counts:
-            self._request_counts[client_ip] = {'count': 1, 'window_start': now}
+        """Implement rate limiting (thread-safe, on the monotonic clock so wall-clock jumps can't reset windows)"""
+        with self._rate_limit_lock:
+            now = time.monotonic()
+            window_start = now - self.rate_limit_window
+            
+            # Clean old entries in place
+            for ip in [ip for ip, count in self._request_counts.items() if count['window_start'] <= window_start]:
+                del self._request_counts[ip]
+            
+            # Check current IP
+            count = self._request_counts.get(client_ip)
+            if count is None:
+                self._request_counts[client_ip] = {'count': 1, 'window_start': now}
+                return True
+            
+            if count['count'] >= self.rate_limit_requests:
+                return False
+            
+            count['count'] += 1
             return True
-        
-        if self._request_counts[client_ip]['count'] >= self.rate_limit_requests:
-            return False
-        
-        self._request_counts[client_ip]['count'] += 1
-        return True
     
     def _log_operation(self, cache_type: str, operation: str, success: bool, 
                       client_ip: str = None, user_agent: str = None, data_size: int = 0):
@@ -193,13 +211,12 @@ class SecureSupabaseCacheManager:
                     'success': success
                 }
                 
-                with httpx.Client() as client:
-                    response = client.post(
-                        f"{self.base_url}cache_audit_log",
-                        headers=self.headers,
-                        json=log_data
-                    )
-                    response.raise_for_status()
+                response = self._client.post(
+                    f"{self.base_url}cache_audit_log",
+                    headers=self.headers,
+                    json=log_data
+                )
+                response.raise_for_status()
         except Exception as e:
             logger.error(f"Failed to log operation: {e}")
     
@@ -230,25 +247,46 @@ class SecureSupabaseCacheManager:
                 'Content-Type': 'application/json',
                 'Accept': 'application/json'
             }
+            # Upsert headers never change, so build them once instead of per save
+            self._upsert_headers = {**self.headers, 'Prefer': 'resolution=merge-duplicates'}
+            
+            # One pooled HTTP/2 client so reads, saves and audit logs reuse the same TLS connection
+            self._client = httpx.Client(
+                timeout=30.0,
+                limits=httpx.Limits(
+                    max_connections=10,
+                    max_keepalive_connections=5,
+                    keepalive_expiry=30.0
+                ),
+                http2=True
+            )
             
             # Test connection with minimal query
-            with httpx.Client() as client:
-                response = client.get(
-                    self.base_url + 'cache_storage?select=id&limit=1',
-                    headers=self.headers
-                )
-                response.raise_for_status()
+            response = self._client.get(
+                self.base_url + 'cache_storage?select=id&limit=1',
+                headers=self.headers
+            )
+            response.raise_for_status()
             
             logger.info("✅ Secure Supabase cache manager initialized")
             
         except Exception as e:
             logger.error(f"❌ Failed to initialize Supabase: {e}")
             self.enabled = False
+            self._close_client()
+    
+    def _close_client(self):
+        """Close the pooled HTTP client and disable the manager (safe to call more than once)"""
+        # Disabled first so no caller starts a request on a client that is about to close
+        self.enabled = False
+        if self._client is not None:
+            self._client.close()
+            self._client = None
     
     def get_cache(self, cache_type: str, project_id: str = "fundraising-app", 
                   client_ip: str = None, user_agent: str = None) -> Optional[Dict[str, Any]]:
         """Get cache data with security validation"""
-        if not self.enabled or not self.base_url:
+        if not self.enabled or not self.base_url or self._client is None:
             return None
         
         # Rate limiting
@@ -262,28 +300,29 @@ class SecureSupabaseCacheManager:
                 project_id_num = self._get_project_id(project_id)
                 
                 # Build query URL
-                query_url = f"{self.base_url}cache_storage?select=data,last_fetch,last_rich_fetch&cache_type=eq.{cache_type}&project_id=eq.{project_id_num}"
+                query_url = f"{self.base_url}cache_storage?select=data,last_fetch,last_rich_fetch,updated_at&cache_type=eq.{cache_type}&project_id=eq.{project_id_num}"
                 
-                with httpx.Client() as client:
-                    response = client.get(query_url, headers=self.headers)
-                    response.raise_for_status()
+                response = self._client.get(query_url, headers=self.headers)
+                response.raise_for_status()
                     
-                    result_data = response.json()
+                # The activities payload is the largest response we parse - decode it with orjson when available
+                result_data = json_loads(response.content)
                     
-                    if result_data:
-                        cache_data = result_data[0]
-                        data_size = len(json.dumps(cache_data['data']))
+                if result_data:
+                    cache_data = result_data[0]
+                    data_size = len(json_dumps_bytes(cache_data['data']))
                         
-                        self._log_operation(cache_type, 'READ', True, client_ip, user_agent, data_size)
-                        logger.info(f"✅ Loaded {cache_type} cache from Supabase")
+                    self._log_operation(cache_type, 'READ', True, client_ip, user_agent, data_size)
+                    logger.info(f"✅ Loaded {cache_type} cache from Supabase")
                         
-                        return {
-                            'data': cache_data['data'],
-                            'last_fetch': cache_data['last_fetch'],
-                            'last_rich_fetch': cache_data['last_rich_fetch']
-                        }
+                    return {
+                        'data': cache_data['data'],
+                        'last_fetch': cache_data['last_fetch'],
+                        'last_rich_fetch': cache_data['last_rich_fetch'],
+                        'updated_at': cache_data.get('updated_at')
+                    }
                     
-                    self._log_operation(cache_type, 'READ', True, client_ip, user_agent, 0)
+                self._log_operation(cache_type, 'READ', True, client_ip, user_agent, 0)
                 
         except Exception as e:
             logger.error(f"❌ Supabase read failed for {cache_type}: {e}")
@@ -291,17 +330,43 @@ class SecureSupabaseCacheManager:
         
         return None
     
+    def get_cache_metadata(self, cache_type: str, project_id: str = "fundraising-app") -> Optional[Dict[str, Any]]:
+        """Get only the cache row's timestamps - lets callers revalidate a held copy without downloading the payload"""
+        if not self.enabled or not self.base_url or self._client is None:
+            return None
+        
+        try:
+            with self._lock:
+                project_id_num = self._get_project_id(project_id)
+                query_url = f"{self.base_url}cache_storage?select=updated_at,last_fetch,last_rich_fetch,data_size&cache_type=eq.{cache_type}&project_id=eq.{project_id_num}"
+                
+                response = self._client.get(query_url, headers=self.headers)
+                response.raise_for_status()
+                result_data = json_loads(response.content)
+                
+                if result_data:
+                    return result_data[0]
+                
+        except Exception as e:
+            logger.error(f"❌ Supabase metadata read failed for {cache_type}: {e}")
+        
+        return None
+    
     def save_cache(self, cache_type: str, data: Dict[str, Any], 
                    last_fetch: Optional[datetime] = None,
                    last_rich_fetch: Optional[datetime] = None,
                    project_id: str = "fundraising-app",
-                   client_ip: str = None, user_agent: str = None) -> bool:
-        """Save cache data with security validation"""
-        if not self.enabled or not self.base_url:
+                   client_ip: str = None, user_agent: str = None,
+                   encoded_size: Optional[int] = None) -> bool:
+        """Save cache data with security validation
+        
+        encoded_size lets a caller that has already serialized data skip re-encoding it for the size check.
+        """
+        if not self.enabled or not self.base_url or self._client is None:
             return False
         
         # Validate input
-        is_valid, error_msg = self._validate_input(cache_type, data)
+        is_valid, error_msg = self._validate_input(cache_type, data, encoded_size)
         if not is_valid:
             logger.error(f"❌ Input validation failed: {error_msg}")
             self._log_operation(cache_type, 'WRITE', False, client_ip, user_agent)
@@ -319,11 +384,12 @@ class SecureSupabaseCacheManager:
                 sanitized_data = self._sanitize_data(data)
                 
                 # Calculate data size
-                data_size = len(json.dumps(sanitized_data))
+                data_size = len(json_dumps_bytes(sanitized_data))
                 
                 # Prepare data for upsert
+                project_id_num = self._get_project_id(project_id)
                 upsert_data = {
-                    'project_id': self._get_project_id(project_id),
+                    'project_id': project_id_num,
                     'cache_type': cache_type,
                     'data': sanitized_data,
                     'last_fetch': last_fetch.isoformat() if last_fetch else None,
@@ -331,36 +397,31 @@ class SecureSupabaseCacheManager:
                     'data_size': data_size,
                     'updated_at': datetime.now().isoformat()
                 }
+                # Serialize once and reuse the body for the POST and any PATCH fallback
+                upsert_body = json_dumps_bytes(upsert_data)
                 
-                with httpx.Client() as client:
-                    # Use upsert with proper headers for conflict resolution
-                    upsert_headers = self.headers.copy()
-                    upsert_headers['Prefer'] = 'resolution=merge-duplicates'
-                    
-                    # Try POST first (for new records)
-                    try:
-                        response = client.post(
-                            f"{self.base_url}cache_storage",
-                            headers=upsert_headers,
-                            json=upsert_data
+                # Try POST first (for new records)
+                try:
+                    response = self._client.post(
+                        f"{self.base_url}cache_storage",
+                        headers=self._upsert_headers,
+                        content=upsert_body
+                    )
+                    response.raise_for_status()
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code == 409:
+                        # Conflict - record exists, try PATCH for update
+                        logger.info(f"Record exists for {cache_type}, updating with PATCH")
+                            
+                        # Use PATCH with the same data for upsert behavior
+                        response = self._client.patch(
+                            f"{self.base_url}cache_storage?cache_type=eq.{cache_type}&project_id=eq.{project_id_num}",
+                            headers=self._upsert_headers,
+                            content=upsert_body
                         )
                         response.raise_for_status()
-                    except httpx.HTTPStatusError as e:
-                        if e.response.status_code == 409:
-                            # Conflict - record exists, try PATCH for update
-                            logger.info(f"Record exists for {cache_type}, updating with PATCH")
-                            patch_headers = self.headers.copy()
-                            patch_headers['Prefer'] = 'resolution=merge-duplicates'
-                            
-                            # Use PATCH with the same data for upsert behavior
-                            response = client.patch(
-                                f"{self.base_url}cache_storage?cache_type=eq.{cache_type}&project_id=eq.{self._get_project_id(project_id)}",
-                                headers=patch_headers,
-                                json=upsert_data
-                            )
-                            response.raise_for_status()
-                        else:
-                            raise
+                    else:
+                        raise
                 
                 self._log_operation(cache_type, 'WRITE', True, client_ip, user_agent, data_size)
                 logger.info(f"✅ Saved {cache_type} cache to Supabase")
@@ -372,17 +433,21 @@ class SecureSupabaseCacheManager:
             return False
     
     def _get_project_id(self, project_name: str) -> int:
-        """Get project ID from project name"""
+        """Get project ID from project name (cached after the first successful lookup)"""
+        cached_id = self._project_ids.get(project_name)
+        if cached_id is not None:
+            return cached_id
+        
         try:
             # Query for existing project
             query_url = f"{self.base_url}projects?select=id&project_name=eq.{project_name}"
             
-            with httpx.Client() as client:
-                response = client.get(query_url, headers=self.headers)
-                response.raise_for_status()
-                result_data = response.json()
+            response = self._client.get(query_url, headers=self.headers)
+            response.raise_for_status()
+            result_data = json_loads(response.content)
             
             if result_data:
+                self._project_ids[project_name] = result_data[0]['id']
                 return result_data[0]['id']
             else:
                 # Create project if it doesn't exist
@@ -391,15 +456,15 @@ class SecureSupabaseCacheManager:
                     'description': f'Cache project for {project_name}'
                 }
                 
-                with httpx.Client() as client:
-                    response = client.post(
-                        f"{self.base_url}projects",
-                        headers=self.headers,
-                        json=project_data
-                    )
-                    response.raise_for_status()
-                    result_data = response.json()
-                    return result_data[0]['id']
+                response = self._client.post(
+                    f"{self.base_url}projects",
+                    headers=self.headers,
+                    json=project_data
+                )
+                response.raise_for_status()
+                result_data = json_loads(response.content)
+                self._project_ids[project_name] = result_data[0]['id']
+                return result_data[0]['id']
                 
         except Exception as e:
             logger.error(f"Failed to get project ID for {project_name}: {e}")
@@ -408,17 +473,42 @@ class SecureSupabaseCacheManager:
     def _queue_supabase_save(self, cache_type: str, data: Dict[str, Any], 
                            last_fetch: Optional[datetime] = None,
                            last_rich_fetch: Optional[datetime] = None,
-                           project_id: str = "fundraising-app"):
-        """Queue data for background Supabase save"""
-        self._pending_supabase_saves.append({
-            'cache_type': cache_type,
-            'data': data,
-            'last_fetch': last_fetch,
-            'last_rich_fetch': last_rich_fetch,
-            'project_id': project_id,
-            'timestamp': datetime.now(),
-            'retry_count': 0
-        })
+                           project_id: str = "fundraising-app",
+                           on_saved: Optional[Callable[[], None]] = None,
+                           encoded_size: Optional[int] = None):
+        """Queue data for background Supabase save, coalescing with any pending save of the same cache
+        
+        on_saved is called from the retry thread once this data has actually been written.
+        """
+        with self._retry_lock:
+            for save_item in self._pending_supabase_saves:
+                if save_item['cache_type'] == cache_type and save_item['project_id'] == project_id:
+                    # Only the latest snapshot matters - overwrite in place and keep the current backoff
+                    save_item.update({
+                        'data': data,
+                        'last_fetch': last_fetch,
+                        'last_rich_fetch': last_rich_fetch,
+                        'on_saved': on_saved,
+                        'encoded_size': encoded_size,
+                        'timestamp': datetime.now(),
+                        'retry_count': 0
+                    })
+                    logger.info(f"Coalesced {cache_type} cache into pending background save")
+                    return
+            
+            self._pending_supabase_saves.append({
+                'cache_type': cache_type,
+                'data': data,
+                'last_fetch': last_fetch,
+                'last_rich_fetch': last_rich_fetch,
+                'project_id': project_id,
+                'on_saved': on_saved,
+                'encoded_size': encoded_size,
+                'timestamp': datetime.now(),
+                'retry_count': 0,
+                'next_attempt_at': 0.0
+            })
+        self._pending_saves_event.set()
         
         logger.info(f"Queued {cache_type} cache for background save")
     
@@ -438,37 +528,57 @@ class SecureSupabaseCacheManager:
         """Background loop to retry failed Supabase saves (thread-safe)"""
         while not self._shutdown_in_progress:
             try:
+                wait_seconds = 0.0
+                save_item = None
                 with self._retry_lock:  # Thread-safe access to retry queue
                     if self._pending_supabase_saves:
-                        save_item = self._pending_supabase_saves[0]
-                        
-                        # Try to save
-                        success = self.save_cache(
-                            save_item['cache_type'],
-                            save_item['data'],
-                            save_item['last_fetch'],
-                            save_item['last_rich_fetch'],
-                            save_item['project_id']
-                        )
-                        
+                        head = self._pending_supabase_saves[0]
+                        wait_seconds = head.get('next_attempt_at', 0.0) - time.time()
+                        if wait_seconds <= 0:
+                            # Copy the fields - a coalescing save may replace them while we upload
+                            save_item = dict(head)
+                
+                if save_item is not None:
+                    # Upload without holding the lock so callers queueing saves never wait on Supabase
+                    success = self.save_cache(
+                        save_item['cache_type'],
+                        save_item['data'],
+                        save_item['last_fetch'],
+                        save_item['last_rich_fetch'],
+                        save_item['project_id'],
+                        encoded_size=save_item.get('encoded_size')
+                    )
+                    
+                    with self._retry_lock:
+                        head = self._pending_supabase_saves[0]
+                        superseded = head['data'] is not save_item['data']
                         if success:
-                            # Success - remove from queue
-                            self._pending_supabase_saves.pop(0)
+                            # Newer data queued meanwhile stays at the head and is uploaded next
+                            if not superseded:
+                                self._pending_supabase_saves.pop(0)
                             logger.info("✅ Background retry successful")
-                        else:
+                        elif not superseded:
                             # Still failing, increment retry count
-                            save_item['retry_count'] += 1
+                            head['retry_count'] += 1
                             
-                            if save_item['retry_count'] > 10:  # Max 10 retries
+                            if head['retry_count'] > 10:  # Max 10 retries
                                 logger.error("Max retries exceeded, removing from queue")
                                 self._pending_supabase_saves.pop(0)
                             else:
-                                # Wait longer before next retry
-                                time.sleep(300)  # 5 minutes
+                                # Back off without holding the lock - new saves can still be queued
+                                head['next_attempt_at'] = time.time() + self.retry_backoff_seconds
+                    
+                    if success and save_item.get('on_saved'):
+                        save_item['on_saved']()
                 
                 if not self._pending_supabase_saves:
-                    # No pending saves, wait
-                    time.sleep(60)  # Check every minute
+                    # No pending saves - block until something is queued or shutdown starts
+                    self._pending_saves_event.wait()
+                    self._pending_saves_event.clear()
+                elif wait_seconds > 0:
+                    # Head of the queue isn't due yet - sleep until it is (or new work/shutdown arrives)
+                    self._pending_saves_event.wait(wait_seconds)
+                    self._pending_saves_event.clear()
                     
             except Exception as e:
                 logger.error(f"Error in background retry loop: {e}")
@@ -480,36 +590,56 @@ class SecureSupabaseCacheManager:
             return
         
         self._shutdown_in_progress = True
+        self._pending_saves_event.set()  # Release the idle retry thread so it can exit
         logger.info("🔄 Graceful shutdown initiated, saving pending data...")
         
+        # The retry thread exits once any upload it is in the middle of settles - wait for that
+        # (the only case worth waiting on) so the queue isn't walked while it pops from it
+        retry_thread = self._supabase_retry_thread
+        if retry_thread is not None and retry_thread is not threading.current_thread():
+            retry_thread.join(timeout=30)
+        still_uploading = retry_thread is not None and retry_thread.is_alive()
+        if still_uploading:
+            logger.warning("Background save still in flight after 30s - leaving it to the retry thread")
+        
         # Save all pending Supabase data
-        self._force_save_all_pending_data()
+        self._force_save_all_pending_data(skip_head=still_uploading)
+        
+        if self._pending_supabase_saves:
+            logger.warning(f"{len(self._pending_supabase_saves)} saves still pending at shutdown")
         
-        # Wait for saves to complete (with timeout)
-        self._wait_for_saves_completion(timeout=30)
+        self._close_client()
         
         logger.info("✅ Graceful shutdown completed")
     
-    def _force_save_all_pending_data(self):
-        """Force save all pending data to Supabase"""
-        for save_item in self._pending_supabase_saves:
+    def _force_save_all_pending_data(self, skip_head: bool = False):
+        """Force save all pending data to Supabase, removing each item once it is saved
+        
+        skip_head leaves the queue head alone while the retry thread is still uploading it.
+        """
+        with self._retry_lock:
+            pending = self._pending_supabase_saves[1:] if skip_head else list(self._pending_supabase_saves)
+        
+        for save_item in pending:
             try:
-                self.save_cache(
+                saved = self.save_cache(
                     save_item['cache_type'],
                     save_item['data'],
                     save_item['last_fetch'],
                     save_item['last_rich_fetch'],
-                    save_item['project_id']
+                    save_item['project_id'],
+                    encoded_size=save_item.get('encoded_size')
                 )
-                logger.info("✅ Saved pending data to Supabase")
             except Exception as e:
                 logger.error(f"Failed to save pending data: {e}")
-    
-    def _wait_for_saves_completion(self, timeout=30):
-        """Wait for all saves to complete with timeout"""
-        start_time = time.time()
-        while self._pending_supabase_saves and (time.time() - start_time) < timeout:
-            time.sleep(1)
-        
-        if self._pending_supabase_saves:
-            logger.warning(f"Timeout: {len(self._pending_supabase_saves)} saves still pending")
+                continue
+            
+            if saved:
+                with self._retry_lock:
+                    # By identity - another pending item could hold equal data
+                    self._pending_supabase_saves[:] = [
+                        item for item in self._pending_supabase_saves if item is not save_item
+                    ]
+                if save_item.get('on_saved'):
+                    save_item['on_saved']()
+                logger.info("✅ Saved pending data to Supabase")
@@ -6,10 +6,15 @@ Tests parallel processing of activities and donations
 
 import pytest
 import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import Mock, patch
 from datetime import datetime
 
-from projects.fundraising_tracking_app.activity_integration.async_processor import AsyncProcessor
+from projects.fundraising_tracking_app.activity_integration import async_processor as async_processor_module
+from projects.fundraising_tracking_app.activity_integration.async_processor import (
+    AsyncProcessor, DeezerLookupError, description_hash, find_music_matches
+)
 
 
 class TestAsyncProcessor:
@@ -118,6 +123,31 @@ class TestAsyncProcessor:
         
         processor.shutdown()
     
+    @pytest.mark.asyncio
+    async def test_music_detection_reuses_widget_for_unchanged_description(self):
+        """Test that music with a matching description hash is not regenerated"""
+        processor = AsyncProcessor()
+        description = "Track: Song by Artist"
+        existing_music = {
+            "detected": {"type": "track", "title": "Song", "artist": "Artist"},
+            "widget_html": "<iframe></iframe>",
+            "description_hash": description_hash(description)
+        }
+        activities = [
+            {"id": 1, "description": description, "music": existing_music},
+            {"id": 2, "description": "Track: Other Song by Artist", "music": existing_music}
+        ]
+        
+        with patch.object(processor, '_generate_deezer_widget', return_value="<div></div>") as mock_widget:
+            result = await processor.process_activities_parallel(activities, operations=['music_detection'])
+        
+        assert result[0]["music"] is existing_music
+        assert result[1]["music"]["widget_html"] == "<div></div>"
+        assert result[1]["music"]["description_hash"] == description_hash("Track: Other Song by Artist")
+        mock_widget.assert_called_once()
+        
+        processor.shutdown()
+    
     @pytest.mark.asyncio
     async def test_process_donations_parallel_empty_list(self):
         """Test processing empty donations list"""
@@ -235,6 +265,109 @@ class TestAsyncProcessor:
         
         processor.shutdown()
     
+    def test_find_music_matches_multiple_labels_on_one_line(self):
+        """Test that an artist never swallows a later label on the same line"""
+        assert find_music_matches("Album: X by Y. Track: Z by W") == {
+            "album": ("X", "Y."),
+            "track": ("Z", "W")
+        }
+        assert find_music_matches("Album: Abbey Road by The Beatles Playlist: Running Mix") == {
+            "album": ("Abbey Road", "The Beatles"),
+            "playlist": ("Running Mix", None)
+        }
+    
+    def test_search_deezer_for_id_uses_cache(self):
+        """Test that repeat Deezer lookups are served from the cache"""
+        processor = AsyncProcessor()
+        
+        with patch.object(processor, '_query_deezer_for_id', return_value=(12345, "track")) as mock_query:
+            first = processor._search_deezer_for_id("Cached Song", "Cached Artist", "track")
+            second = processor._search_deezer_for_id(" cached song ", "CACHED ARTIST", "track")
+            third = processor._search_deezer_for_id("Cached Söng", "Cached Ártist", "track")
+        
+        assert first == (12345, "track")
+        assert second == (12345, "track")
+        assert third == (12345, "track")
+        mock_query.assert_called_once()
+        
+        processor.shutdown()
+    
+    def test_search_deezer_for_id_skips_unsearchable_names(self):
+        """Test that punctuation-only or single-character names never reach Deezer"""
+        processor = AsyncProcessor()
+        
+        with patch.object(processor, '_query_deezer_for_id', return_value=(12345, "track")) as mock_query:
+            assert processor._search_deezer_for_id("?!", "Some Artist", "track") == (None, None)
+            assert processor._search_deezer_for_id("Some Song", "X", "track") == (None, None)
+        
+        mock_query.assert_not_called()
+        
+        processor.shutdown()
+    
+    def test_search_deezer_for_id_coalesces_concurrent_lookups(self):
+        """Test that concurrent lookups for the same music share one Deezer search"""
+        processor = AsyncProcessor()
+        
+        def slow_query(title, artist, music_type):
+            time.sleep(0.2)
+            return 67890, "album"
+        
+        with patch.object(processor, '_query_deezer_for_id', side_effect=slow_query) as mock_query:
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                results = list(pool.map(
+                    lambda _: processor._search_deezer_for_id("Shared Album", "Shared Artist", "album"),
+                    range(4)
+                ))
+        
+        assert results == [(67890, "album")] * 4
+        mock_query.assert_called_once()
+        
+        processor.shutdown()
+    
+    def test_search_deezer_for_id_does_not_cache_failed_lookups(self):
+        """Test that a failed Deezer search is retried while a genuine no-match is cached"""
+        processor = AsyncProcessor()
+        
+        with patch.object(processor, '_query_deezer_for_id', side_effect=DeezerLookupError("timeout")) as mock_query:
+            assert processor._search_deezer_for_id("Flaky Song", "Flaky Artist", "track") == (None, None)
+            assert processor._search_deezer_for_id("Flaky Song", "Flaky Artist", "track") == (None, None)
+        assert mock_query.call_count == 2
+        
+        with patch.object(processor, '_query_deezer_for_id', return_value=(None, None)) as mock_query:
+            processor._search_deezer_for_id("Unknown Song", "Unknown Artist", "track")
+            processor._search_deezer_for_id("Unknown Song", "Unknown Artist", "track")
+        mock_query.assert_called_once()
+        
+        processor.shutdown()
+    
+    def test_query_deezer_for_id_raises_when_requests_fail(self):
+        """Test that HTTP failures surface as DeezerLookupError rather than a no-match"""
+        processor = AsyncProcessor()
+        
+        with patch.object(async_processor_module, 'get_http_client') as mock_client:
+            mock_client.return_value.get.return_value = Mock(status_code=503)
+            with pytest.raises(DeezerLookupError):
+                processor._query_deezer_for_id("Some Song", "Some Artist", "track")
+        
+        processor.shutdown()
+    
+    def test_deezer_id_cache_is_bounded(self):
+        """Test that the Deezer lookup cache evicts the least recently used entries"""
+        processor = AsyncProcessor()
+        
+        with patch.object(async_processor_module, 'DEEZER_CACHE_MAX_ENTRIES', 2), \
+             patch.object(async_processor_module, '_deezer_id_cache', async_processor_module.OrderedDict()) as cache, \
+             patch.object(processor, '_query_deezer_for_id', return_value=(1, "track")) as mock_query:
+            processor._search_deezer_for_id("Song One", "Artist", "track")
+            processor._search_deezer_for_id("Song Two", "Artist", "track")
+            processor._search_deezer_for_id("Song One", "Artist", "track")  # Refreshes "song one"
+            processor._search_deezer_for_id("Song Three", "Artist", "track")
+            
+            assert [key[0] for key in cache] == ["song one", "song three"]
+            assert mock_query.call_count == 3
+        
+        processor.shutdown()
+    
     def test_format_activity_sync(self):
         """Test synchronous activity formatting"""
         processor = AsyncProcessor()
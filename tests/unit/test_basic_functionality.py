@@ -24,7 +24,7 @@ class TestBasicCacheFunctionality:
             # Test basic attributes
             assert hasattr(cache, 'supabase_cache')
             assert hasattr(cache, 'allowed_activity_types')
-            assert cache.allowed_activity_types == ["Run", "Ride"]
+            assert cache.allowed_activity_types == frozenset({"Run", "Ride"})
     
     def test_fundraising_cache_initialization(self):
         """Test that SmartFundraisingCache can be initialized."""
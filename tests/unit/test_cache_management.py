@@ -8,6 +8,7 @@ import pytest
 import os
 import json
 import tempfile
+import time
 from datetime import datetime, timedelta
 from unittest.mock import Mock, patch, MagicMock
 
@@ -25,7 +26,7 @@ class TestActivityCache:
             
             # Test default initialization
             assert cache.cache_duration_hours == 8  # Default from env or 8
-            assert cache.allowed_activity_types == ["Run", "Ride"]
+            assert cache.allowed_activity_types == frozenset({"Run", "Ride"})
             assert cache.supabase_cache is not None
             assert cache._cache_data is None  # Private attribute
             assert cache._cache_loaded_at is None
@@ -72,6 +73,435 @@ class TestActivityCache:
             result = cache.check_and_refresh()
             assert "manual_import_required" in result.get("status", "")
     
+    def test_calculate_bounds_from_polyline(self):
+        """Test bounds calculation and rejection of malformed polylines."""
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
+            cache = ActivityCache()
+
+            bounds = cache._calculate_bounds_from_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq`@")
+            assert bounds == {"south": 38.5, "north": 43.252, "west": -126.453, "east": -120.2}
+
+            # Empty and malformed strings are rejected without decoding
+            assert cache._calculate_bounds_from_polyline("") == {}
+            assert cache._calculate_bounds_from_polyline("not a polyline") == {}
+
+    def test_clean_invalid_activities_saves_once(self):
+        """Test that invalid activities are removed and the cache is saved once."""
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
+            cache = ActivityCache()
+            
+            mock_cache_data = {
+                "timestamp": datetime.now().isoformat(),
+                "activities": [
+                    {"id": 1, "name": "Valid Run", "type": "Run"},
+                    {"id": 2, "name": "Unknown Activity", "type": "Unknown"},
+                    {"id": None, "name": "Missing ID", "type": "Ride"},
+                    {"id": 4, "name": "Valid Ride", "type": "Ride"}
+                ]
+            }
+            
+            with patch.object(cache, '_load_cache', return_value=mock_cache_data), \
+                 patch.object(cache, '_save_cache') as mock_save:
+                
+                result = cache.clean_invalid_activities()
+                
+                assert result["success"] is True
+                assert result["activities_removed"] == 2
+                assert result["activities_remaining"] == 2
+                mock_save.assert_called_once()
+                saved_ids = [a["id"] for a in mock_save.call_args[0][0]["activities"]]
+                assert saved_ids == [1, 4]
+    
+    def test_add_gpx_activities_reuses_bounds_for_unchanged_polyline(self):
+        """Test that re-importing an unchanged route keeps the cached map data."""
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
+            cache = ActivityCache()
+            
+            route = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+            existing_map = {"polyline": route, "bounds": {"south": 38.5, "north": 43.252, "west": -126.453, "east": -120.2}}
+            mock_cache_data = {
+                "timestamp": datetime.now().isoformat(),
+                "activities": [{"id": 1, "name": "Morning Run", "type": "Run", "map": existing_map}]
+            }
+            gpx_activity = {"id": 1, "name": "Morning_Run", "type": "Run", "polyline": route, "bounds": None}
+            
+            with patch.object(cache, '_load_cache', return_value=mock_cache_data), \
+                 patch.object(cache, '_save_cache') as mock_save, \
+                 patch.object(cache, '_calculate_bounds_from_polyline') as mock_bounds:
+                
+                new_count = cache.add_gpx_activities([gpx_activity])
+                
+                assert new_count == 0
+                mock_bounds.assert_not_called()
+                saved_activity = mock_save.call_args[0][0]["activities"][0]
+                assert saved_activity["map"] == existing_map
+    
+    def test_load_cache_skips_supabase_after_recent_miss(self):
+        """Test that an empty Supabase cache is not re-queried within the in-memory TTL."""
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
+            cache = ActivityCache()
+            cache.supabase_cache.enabled = True
+            
+            with patch.object(cache.supabase_cache, 'get_cache', return_value=None) as mock_get:
+                cache._load_cache()
+                cache._load_cache()
+                
+                mock_get.assert_called_once()
+    
+    def test_load_cache_revalidates_unchanged_supabase_row(self):
+        """Test that an expired in-memory cache is kept when Supabase's updated_at is unchanged."""
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
+            cache = ActivityCache()
+            cache.supabase_cache.enabled = True
+        
+        cache_data = {"timestamp": datetime.now().isoformat(), "activities": []}
+        cache._cache_data = cache_data
+        cache._cache_updated_at = "2025-06-01T10:00:00"
+        cache._cache_loaded_at = datetime.now() - timedelta(seconds=cache._cache_ttl + 1)
+        
+        with patch.object(cache.supabase_cache, 'get_cache_metadata',
+                          return_value={"updated_at": "2025-06-01T10:00:00"}), \
+             patch.object(cache.supabase_cache, 'get_cache') as mock_get:
+            assert cache._load_cache() is cache_data
+            mock_get.assert_not_called()
+    
+    def test_validate_cache_integrity_checks_recent_gps_coverage(self):
+        """Test that recent activities without GPS data fail an otherwise healthy, settled cache."""
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
+            cache = ActivityCache()
+        
+        def make_activity(activity_id, start_date_local, with_map=True):
+            return {
+                "id": activity_id,
+                "name": f"Activity {activity_id}",
+                "type": "Run",
+                "start_date_local": start_date_local,
+                "map": {"polyline": "abc", "bounds": {"north": 1}} if with_map else {}
+            }
+        
+        activities = [make_activity(i, "2025-06-01T10:00:00Z") for i in range(1, 11)]
+        cache_data = {
+            "timestamp": (datetime.now() - timedelta(hours=2)).isoformat(),
+            "activities": activities
+        }
+        assert cache._validate_cache_integrity(cache_data) is True
+        
+        this_month = datetime.now().strftime("%Y-%m")
+        cache_data["activities"] = activities + [make_activity(99, f"{this_month}-01T10:00:00Z", with_map=False)]
+        assert cache._validate_cache_integrity(cache_data) is False
+    
+    def test_validate_cache_integrity_skips_rescan_for_unchanged_data(self):
+        """Test that a cache that fully passed the integrity check is not rescanned."""
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
+            cache = ActivityCache()
+        
+        activities = [
+            {"id": i, "name": "Run", "type": "Run", "start_date_local": "2025-06-01T10:00:00Z",
+             "map": {"polyline": "abc", "bounds": {"north": 1}}}
+            for i in range(1, 6)
+        ]
+        cache_data = {"timestamp": (datetime.now() - timedelta(hours=2)).isoformat(), "activities": activities}
+        
+        assert cache._validate_cache_integrity(cache_data) is True
+        
+        # Corrupting in place without a new timestamp is not rescanned...
+        activities[0]["name"] = None
+        activities[1]["name"] = None
+        assert cache._validate_cache_integrity(cache_data) is True
+        
+        # ...but a save always re-validates
+        with patch.object(cache.supabase_cache, 'enabled', False):
+            cache._save_cache(cache_data)
+        assert cache._integrity_cache_key is None
+        
+        # A failed check is remembered too, so unchanged corrupt data is not rescanned on every read
+        assert cache._integrity_failed_key is not None
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.logger') as mock_logger:
+            assert cache._validate_cache_integrity(cache_data) is False
+            mock_logger.warning.assert_not_called()
+    
+    def test_save_cache_stores_coverage_counts_for_reads(self):
+        """Test that counts stored on save are reused by later integrity checks."""
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
+            cache = ActivityCache()
+        
+        activities = [
+            {"id": i, "name": "Run", "type": "Run", "start_date_local": "2025-06-01T10:00:00Z",
+             "map": {"polyline": "abc", "bounds": {"north": 1}}}
+            for i in range(1, 6)
+        ]
+        with patch.object(cache.supabase_cache, 'enabled', False):
+            cache._save_cache({"timestamp": datetime.now().isoformat(), "activities": activities})
+        
+        counts = cache._cache_data["_counts"]
+        assert counts["total"] == 5
+        assert counts["missing_basic"] == 0
+        assert counts["polyline"] == 5
+        
+        # Threshold comparisons use the stored counts rather than rescanning
+        loaded = dict(cache._cache_data, _counts=dict(counts, missing_basic=5))
+        assert cache._validate_cache_integrity(loaded) is False
+    
+    def test_stop_background_services_signals_workers(self):
+        """Test that stopping background services wakes workers and flushes Supabase saves."""
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
+            cache = ActivityCache()
+            
+            with patch.object(cache.supabase_cache, 'start_background_services'):
+                cache.start_background_services()
+            
+            with patch.object(cache.supabase_cache, 'graceful_shutdown') as mock_shutdown:
+                cache.stop_background_services()
+                cache.stop_background_services()
+            
+            assert cache._shutdown_event.is_set()
+            mock_shutdown.assert_called_once()
+    
+    def test_save_cache_skips_supabase_write_for_unchanged_payload(self):
+        """Test that re-saving an identical payload does not write to Supabase again."""
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
+            cache = ActivityCache()
+        
+        activities = [
+            {"id": i, "name": "Run", "type": "Run", "start_date_local": "2025-06-01T10:00:00Z",
+             "map": {"polyline": "abc", "bounds": {"north": 1}}}
+            for i in range(1, 6)
+        ]
+        
+        timestamp = datetime.now().isoformat()
+        
+        with patch.object(cache.supabase_cache, 'enabled', True), \
+             patch.object(cache.supabase_cache, 'save_cache', return_value=True) as mock_save:
+            cache._save_cache({"timestamp": timestamp, "activities": activities})
+            cache._save_cache({"timestamp": timestamp, "activities": activities})
+            assert mock_save.call_count == 1
+            
+            activities[0]["name"] = "Renamed Run"
+            cache._save_cache({"timestamp": timestamp, "activities": activities})
+            assert mock_save.call_count == 2
+            
+            # Metadata-only changes are written too
+            cache._save_cache({"timestamp": timestamp, "last_rich_fetch": timestamp, "activities": activities})
+            assert mock_save.call_count == 3
+    
+    def test_save_cache_retries_identical_payload_after_failed_write(self):
+        """Test that a failed Supabase write does not cause later identical saves to be skipped."""
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
+            cache = ActivityCache()
+        
+        activities = [
+            {"id": i, "name": "Run", "type": "Run", "start_date_local": "2025-06-01T10:00:00Z",
+             "map": {"polyline": "abc", "bounds": {"north": 1}}}
+            for i in range(1, 6)
+        ]
+        timestamp = datetime.now().isoformat()
+        
+        with patch.object(cache.supabase_cache, 'enabled', True), \
+             patch.object(cache.supabase_cache, 'save_cache', return_value=False) as mock_save:
+            cache._save_cache({"timestamp": timestamp, "activities": activities})
+            cache._save_cache({"timestamp": timestamp, "activities": activities})
+            assert mock_save.call_count == 2
+    
+    def test_save_cache_rewrites_confirmed_payload_after_different_queued_save(self):
+        """Test that X -> Y (queued) -> X writes X again instead of leaving Supabase holding Y."""
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
+            cache = ActivityCache()
+        
+        def build(name):
+            return [
+                {"id": i, "name": name, "type": "Run", "start_date_local": "2025-06-01T10:00:00Z",
+                 "map": {"polyline": "abc", "bounds": {"north": 1}}}
+                for i in range(1, 6)
+            ]
+        timestamp = datetime.now().isoformat()
+        supabase_cache = cache.supabase_cache
+        
+        with patch.object(supabase_cache, 'enabled', True), \
+             patch.object(supabase_cache, 'save_cache', return_value=True):
+            # X is confirmed synchronously
+            with patch.object(supabase_cache, 'background_saves_running', return_value=False):
+                cache._save_cache({"timestamp": timestamp, "activities": build("X")})
+            
+            with patch.object(supabase_cache, 'background_saves_running', return_value=True):
+                cache._save_cache({"timestamp": timestamp, "activities": build("Y")})
+                y_on_saved = supabase_cache._pending_supabase_saves[0]["on_saved"]
+                
+                cache._save_cache({"timestamp": timestamp, "activities": build("X")})
+            
+            pending = supabase_cache._pending_supabase_saves
+            assert len(pending) == 1
+            assert pending[0]["data"]["activities"][0]["name"] == "X"
+            
+            # Y's upload completing after X was queued must not mark Y as what the row holds
+            y_on_saved()
+            assert cache._last_saved_payload_hash is None
+            pending[0]["on_saved"]()
+            assert cache._last_saved_payload_hash == cache._latest_payload_hash
+    
+    def test_save_cache_queues_supabase_write_when_background_running(self):
+        """Test that saves are written behind through the retry queue once it is running."""
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
+            cache = ActivityCache()
+        
+        activities = [
+            {"id": i, "name": "Run", "type": "Run", "start_date_local": "2025-06-01T10:00:00Z",
+             "map": {"polyline": "abc", "bounds": {"north": 1}}}
+            for i in range(1, 6)
+        ]
+        
+        with patch.object(cache.supabase_cache, 'enabled', True), \
+             patch.object(cache.supabase_cache, 'background_saves_running', return_value=True), \
+             patch.object(cache.supabase_cache, 'save_cache') as mock_save:
+            cache._save_cache({"timestamp": datetime.now().isoformat(), "activities": activities})
+        
+            mock_save.assert_not_called()
+            pending = cache.supabase_cache._pending_supabase_saves
+            assert len(pending) == 1
+            queued = pending[0]["data"]
+            assert queued["activities"] == activities
+            
+            # Re-saving the queued dict (as the corruption check does) must not annotate it in place
+            queued_snapshot = dict(queued)
+            cache._save_cache({**cache._cache_data, "last_corruption_check": "now"})
+            assert queued == queued_snapshot
+            assert pending[0]["data"]["last_corruption_check"] == "now"
+    
+    def test_save_cache_logs_unserializable_data_without_raising(self):
+        """Test that a payload that can't be encoded is reported instead of raising out of the save."""
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
+            cache = ActivityCache()
+        
+        activities = [
+            {"id": i, "name": "Run", "type": "Run", "start_date_local": "2025-06-01T10:00:00Z",
+             "map": {"polyline": "abc", "bounds": {"north": 1}}, "tags": {"unserializable"}}
+            for i in range(1, 6)
+        ]
+        
+        with patch.object(cache.supabase_cache, 'enabled', True), \
+             patch.object(cache.supabase_cache, 'save_cache') as mock_save, \
+             patch('projects.fundraising_tracking_app.activity_integration.activity_cache.logger') as mock_logger:
+            cache._save_cache({"timestamp": datetime.now().isoformat(), "activities": activities})
+        
+            mock_save.assert_not_called()
+            assert cache.supabase_cache._pending_supabase_saves == []
+            mock_logger.error.assert_called_once()
+    
+    def test_is_cache_valid_skips_integrity_scan_for_fresh_cache(self):
+        """Test that a fresh cache is accepted on its timestamp alone."""
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
+            cache = ActivityCache()
+        
+        activities = [{"id": i, "type": "Run"} for i in range(1, 12)]
+        fresh = {"timestamp": datetime.now().isoformat(), "activities": activities}
+        stale = {"timestamp": (datetime.now() - timedelta(days=30)).isoformat(), "activities": activities}
+        
+        with patch.object(cache, '_validate_cache_integrity', return_value=True) as mock_integrity:
+            assert cache._is_cache_valid(fresh) is True
+            mock_integrity.assert_not_called()
+        
+            assert cache._is_cache_valid(stale) is True
+            mock_integrity.assert_called_once_with(stale)
+            
+            # The answer for an unchanged snapshot is memoized
+            assert cache._is_cache_valid(stale) is True
+            mock_integrity.assert_called_once_with(stale)
+    
+    def test_queue_supabase_save_coalesces_pending_saves(self):
+        """Test that repeated background saves of the same cache keep only the latest data."""
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
+            cache = ActivityCache()
+        
+        supabase_cache = cache.supabase_cache
+        supabase_cache._queue_supabase_save("strava", {"activities": [1]})
+        supabase_cache._queue_supabase_save("strava", {"activities": [1, 2]})
+        supabase_cache._queue_supabase_save("fundraising", {"total": 10})
+        
+        pending = supabase_cache._pending_supabase_saves
+        assert [item["cache_type"] for item in pending] == ["strava", "fundraising"]
+        assert pending[0]["data"] == {"activities": [1, 2]}
+    
+    def test_retry_loop_uploads_without_holding_queue_lock(self):
+        """Test that the retry thread releases the queue lock during the Supabase upload."""
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
+            cache = ActivityCache()
+        
+        supabase_cache = cache.supabase_cache
+        on_saved = Mock()
+        lock_held_during_save = []
+        
+        def fake_save(*args, **kwargs):
+            lock_held_during_save.append(supabase_cache._retry_lock.locked())
+            supabase_cache._shutdown_in_progress = True
+            supabase_cache._pending_saves_event.set()
+            return True
+        
+        supabase_cache._queue_supabase_save("strava", {"activities": [1]}, on_saved=on_saved)
+        with patch.object(supabase_cache, 'save_cache', side_effect=fake_save):
+            supabase_cache._supabase_retry_loop()
+        
+        assert lock_held_during_save == [False]
+        assert supabase_cache._pending_supabase_saves == []
+        on_saved.assert_called_once()
+    
+    def test_graceful_shutdown_drains_queue_without_waiting(self):
+        """Test that shutdown saves each pending item once, clears the queue and doesn't stall."""
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
+            cache = ActivityCache()
+        
+        supabase_cache = cache.supabase_cache
+        supabase_cache.enabled = True
+        supabase_cache._queue_supabase_save("strava", {"activities": [1]})
+        supabase_cache._queue_supabase_save("fundraising", {"total": 10})
+        
+        started = time.monotonic()
+        with patch.object(supabase_cache, 'save_cache', return_value=True) as mock_save:
+            supabase_cache.graceful_shutdown()
+        
+        assert time.monotonic() - started < 5
+        assert mock_save.call_count == 2
+        assert supabase_cache._pending_supabase_saves == []
+        # The closed client can't be reused
+        assert supabase_cache.enabled is False
+        assert supabase_cache.get_cache("activities") is None
+    
+    def test_supabase_rate_limit_counts_per_ip(self):
+        """Test that the Supabase rate limiter caps requests per IP within the window."""
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
+            cache = ActivityCache()
+        
+        supabase_cache = cache.supabase_cache
+        supabase_cache.rate_limit_requests = 2
+        
+        assert supabase_cache._check_rate_limit("1.1.1.1") is True
+        assert supabase_cache._check_rate_limit("1.1.1.1") is True
+        assert supabase_cache._check_rate_limit("1.1.1.1") is False
+        assert supabase_cache._check_rate_limit("2.2.2.2") is True
+
+    def test_get_cache_status_reloads_snapshot_older_than_30s(self):
+        """Test that status is served from memory only while the in-memory copy is fresh."""
+        with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
+            cache = ActivityCache()
+        
+        cache._cache_data = {"timestamp": datetime.now().isoformat(), "activities": [{"id": 1}]}
+        reloaded = {"timestamp": datetime.now().isoformat(), "activities": [{"id": 1}, {"id": 2}]}
+        
+        with patch.object(cache, '_load_cache', return_value=reloaded) as mock_load:
+            cache._cache_loaded_at = datetime.now()
+            assert cache.get_cache_status()["activities_count"] == 1
+            mock_load.assert_not_called()
+            
+            cache._cache_loaded_at = datetime.now() - timedelta(seconds=31)
+            assert cache.get_cache_status()["activities_count"] == 2
+            mock_load.assert_called_once()
+    
+    def test_iso_epoch_matches_parsed_timestamp(self):
+        """Test that the cached epoch helper agrees with datetime parsing for naive and 'Z' timestamps."""
+        from projects.fundraising_tracking_app.activity_integration.activity_cache import _iso_epoch
+        
+        naive = datetime.now().isoformat()
+        assert _iso_epoch(naive) == datetime.fromisoformat(naive).timestamp()
+        assert _iso_epoch("2025-06-01T12:00:00Z") == datetime.fromisoformat("2025-06-01T12:00:00+00:00").timestamp()
+        
     def test_cache_methods_exist(self):
         """Test that cache methods exist."""
         with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
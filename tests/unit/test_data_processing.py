@@ -9,6 +9,8 @@ from datetime import datetime, timedelta
 from unittest.mock import Mock, patch
 
 from projects.fundraising_tracking_app.activity_integration.activity_cache import ActivityCache
+from projects.fundraising_tracking_app.activity_integration.activity_api import _apply_feed_filters
+from projects.fundraising_tracking_app.activity_integration.models import FeedRequest
 from projects.fundraising_tracking_app.fundraising_scraper.fundraising_scraper import SmartFundraisingCache
 
 
@@ -67,6 +69,37 @@ class TestActivityDataProcessing:
         assert filtered[1]["type"] == "Ride"
         assert all(activity["type"] in ["Run", "Ride"] for activity in filtered)
     
+    def test_apply_feed_filters_date_range(self):
+        """Test feed date filtering keeps in-range and unparseable activities in order."""
+        activities = [
+            {"id": 1, "start_date_local": "2025-05-30T08:00:00Z"},
+            {"id": 2, "start_date_local": "2025-06-05T08:00:00Z"},
+            {"id": 3, "start_date_local": "not a date"},
+            {"id": 4, "start_date_local": "2025-06-20T08:00:00Z"},
+            {"id": 5}
+        ]
+        request = FeedRequest(date_from=datetime(2025, 6, 1), date_to=datetime(2025, 6, 10))
+        
+        filtered = _apply_feed_filters(activities, request)
+        
+        assert [a["id"] for a in filtered] == [2, 3, 5]
+    
+    def test_apply_feed_filters_has_photos(self):
+        """Test photo filtering handles both GPX photo lists and legacy primary dicts."""
+        activities = [
+            {"id": 1, "photos": [{"urls": {"300": "https://example.com/a.jpg"}}]},
+            {"id": 2, "photos": []},
+            {"id": 3, "photos": {"primary": {"url": "https://example.com/b.jpg"}}},
+            {"id": 4, "photos": {"primary": {}}},
+            {"id": 5}
+        ]
+        
+        with_photos = _apply_feed_filters(activities, FeedRequest(has_photos=True))
+        without_photos = _apply_feed_filters(activities, FeedRequest(has_photos=False))
+        
+        assert [a["id"] for a in with_photos] == [1, 3]
+        assert [a["id"] for a in without_photos] == [2, 4, 5]
+    
     def test_detect_music_in_description(self):
         """Test the _detect_music_sync method for extracting music information."""
         with patch('projects.fundraising_tracking_app.activity_integration.activity_cache.threading.Thread'):
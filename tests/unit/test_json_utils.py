@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Unit tests for JSON serialization helpers
+"""
+
+import json
+from unittest.mock import patch
+
+from projects.fundraising_tracking_app.activity_integration import json_utils
+from projects.fundraising_tracking_app.activity_integration.json_utils import json_dumps_bytes, json_loads
+
+
+class TestJsonUtils:
+    """Test the JSON serialization helpers"""
+    
+    def test_round_trip(self):
+        """Test that data survives a dumps/loads round trip"""
+        data = {"activities": [{"id": 1, "name": "Morning Run 🏃", "distance": 5000.5}], "timestamp": "2025-06-01T10:00:00"}
+        
+        encoded = json_dumps_bytes(data)
+        
+        assert isinstance(encoded, bytes)
+        assert json_loads(encoded) == data
+        assert json.loads(encoded) == data
+    
+    def test_stdlib_fallback_matches_orjson(self):
+        """Test that the stdlib fallback produces the same compact bytes"""
+        data = {"name": "Café ride", "values": [1, 2.5, None, True]}
+        expected = json_dumps_bytes(data)
+        
+        with patch.object(json_utils, 'ORJSON_AVAILABLE', False):
+            assert json_dumps_bytes(data) == expected
+            assert json_loads(expected.decode("utf-8")) == data